@@ -0,0 +1,640 @@
+"""SRT 字幕翻译工具的离线性能基准
+
+用法:
+    python3 benchmark.py cues [--count 10000]              # 字幕解析、规划与渲染的单条开销
+    python3 benchmark.py corpus --out corpus [--files 20]  # 生成合成 SRT 语料
+    python3 benchmark.py run [--corpus corpus]             # 对本地模拟 DeepL 运行完整翻译流程
+    python3 benchmark.py run --backend dictionary          # 对离线翻译后端运行完整翻译流程
+    python3 benchmark.py tm [--entries N] [--sqlite]       # 翻译记忆索引的构建与近似查询开销
+    python3 benchmark.py startup [--max-ms 100]            # 启动耗时 (python -X importtime 与首行输出)
+    python3 benchmark.py encoding [--files 10]             # 混合编码语料上的编码检测准确率与耗时
+    python3 benchmark.py serve                             # 任务接口的故障隔离检查 (403 的任务失败，后续任务完成)
+"""
+import re
+import io
+import os
+import sys
+import time
+import random
+import codecs
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import tracemalloc
+from pathlib import Path
+from typing import List, Tuple
+
+import main
+from mock_deepl import MockDeepLState, start_mock_server
+
+SAMPLE_LINES = [
+    "Previously on...",
+    "I don't know.",
+    "Where are you going?",
+    "[door slams]",
+    "We need to talk about what happened last night.",
+    "{\\an8}Somewhere in the North Atlantic",
+    "- Get down!\n- Now!",
+    "Thank you.",
+    "You have no idea what you're dealing with.",
+    "It's been a long time, old friend.",
+]
+
+def generate_srt(count: int, seed: int = 0, unique_ratio: float = 0.5) -> str:
+    """生成含 count 条字幕的合成 SRT 文本。
+
+    unique_ratio 控制带编号 (不可能命中缓存或去重) 的台词比例，其余取自 SAMPLE_LINES。
+    """
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(count):
+        start = i * 2500
+        if rng.random() < unique_ratio:
+            text = f"{rng.choice(SAMPLE_LINES).splitlines()[0]} #{i}"
+        else:
+            text = rng.choice(SAMPLE_LINES)
+        blocks.append(f"{i + 1}\n{main.format_timestamp(start)} --> {main.format_timestamp(start + 2000)}\n{text}\n")
+    return "\n".join(blocks) + "\n"
+
+def legacy_pipeline(content: str) -> list:
+    """旧实现：整文件 re.split + 字符串拼接，规划与重建阶段各拆分并计算一次原文"""
+    blocks = re.split(r"(\d+\n\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}\n)", content.strip())[1:]
+    indexed_blocks = [blocks[i] + blocks[i+1] for i in range(0, len(blocks), 2)]
+    for block in indexed_blocks:
+        index, timestamp, *text_lines = block.split("\n")
+        re.sub(r"\[.*?\]|\{.*?\}", "", " ".join(text_lines)).strip()
+    for block in indexed_blocks:
+        index, timestamp, *text_lines = block.split("\n")
+        english_text = re.sub(r"\[.*?\]|\{.*?\}", "", " ".join(text_lines)).strip()
+        "\n".join([index, timestamp, *[l for l in text_lines if l.strip()], english_text])
+    return indexed_blocks
+
+def cue_pipeline(content: str) -> list:
+    """新实现：流式解析为 Cue，原文与去重键只计算一次，规划与渲染直接复用"""
+    cues = list(main.iter_srt_cues(io.StringIO(content)))
+    for cue in cues:
+        cue.key
+    for cue in cues:
+        main.render_cue(cue, cue.text)
+    return cues
+
+def measure(func, content: str, repeat: int = 5):
+    """返回 (最快耗时秒数, 结果常驻内存字节数)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func(content)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, retained
+
+def bench_cues(args):
+    content = generate_srt(args.count)
+    print(f"📊 字幕表示基准: {args.count:,} 条字幕，{len(content):,} 字符")
+    print(f"{'实现':<10}{'总耗时 (ms)':>14}{'单条 (µs)':>12}{'单条内存 (B)':>14}")
+    for name, func in (("legacy", legacy_pipeline), ("cue", cue_pipeline)):
+        seconds, retained = measure(func, content, args.repeat)
+        print(f"{name:<10}{seconds * 1000:>14.1f}{seconds / args.count * 1e6:>12.2f}{retained / args.count:>14.0f}")
+
+def random_sentence(rng: random.Random, vocabulary: List[str]) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(4, 12))).capitalize() + "."
+
+def near_duplicate(rng: random.Random, sentence: str, vocabulary: List[str]) -> str:
+    """改写句末标点、大小写或替换一个词，模拟字幕中常见的近似重复"""
+    words = sentence.rstrip(".").split()
+    choice = rng.randrange(3)
+    if choice == 0:
+        return " ".join(words) + rng.choice(["...", "!", " ."])
+    if choice == 1:
+        return sentence.upper()
+    words[rng.randrange(len(words))] = rng.choice(vocabulary)
+    return " ".join(words) + "."
+
+def bench_tm(args):
+    rng = random.Random(args.seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = ["".join(rng.choice(letters) for _ in range(rng.randint(2, 8))) for _ in range(5000)]
+    sources = [random_sentence(rng, vocabulary) for _ in range(args.entries)]
+
+    if args.sqlite:
+        with tempfile.TemporaryDirectory() as tmp:
+            bench_tm_sqlite(args, rng, vocabulary, sources, Path(tmp) / "cache.sqlite3")
+        return
+
+    memory = main.TranslationMemory(args.threshold)
+    start = time.perf_counter()
+    for text in sources:
+        memory.add(text, f"ZH:{text}")
+    build = time.perf_counter() - start
+
+    def run_queries(queries: List[str]) -> tuple:
+        start = time.perf_counter()
+        hits = sum(memory.lookup(text) is not None for text in queries)
+        return hits / len(queries), (time.perf_counter() - start) / len(queries)
+
+    near = [near_duplicate(rng, rng.choice(sources), vocabulary) for _ in range(args.queries)]
+    unrelated = [random_sentence(rng, vocabulary) for _ in range(args.queries)]
+    near_rate, near_time = run_queries(near)
+    unrelated_rate, unrelated_time = run_queries(unrelated)
+
+    print(f"📊 翻译记忆基准: {len(memory):,} 条，阈值 {args.threshold}，"
+          f"{len(memory.buckets):,} 个 LSH 桶")
+    print(f"   构建: {build:.2f} 秒 ({build / args.entries * 1e6:.1f} µs/条)")
+    print(f"   近似重复查询: 命中率 {near_rate * 100:.1f}%，{near_time * 1e6:.1f} µs/次")
+    print(f"   无关文本查询: 命中率 {unrelated_rate * 100:.1f}%，{unrelated_time * 1e6:.1f} µs/次")
+
+def bench_tm_sqlite(args, rng: random.Random, vocabulary: List[str], sources: List[str], db_file: Path):
+    """SQLite 缓存后端的持久化翻译记忆：首次构建、之后的启动开销与查询延迟"""
+    backend = main.SqliteCacheBackend(db_file)
+    backend.set_many((text, f"ZH:{text}") for text in sources)
+    start = time.perf_counter()
+    backend.translation_memory(args.threshold)
+    build = time.perf_counter() - start
+    backend.close()
+
+    # 新进程的情形：重新打开数据库，索引无需重建
+    start = time.perf_counter()
+    backend = main.SqliteCacheBackend(db_file)
+    memory = backend.translation_memory(args.threshold)
+    reopen = time.perf_counter() - start
+
+    def run_queries(queries: List[str]) -> tuple:
+        start = time.perf_counter()
+        hits = sum(memory.lookup(text) is not None for text in queries)
+        return hits / len(queries), (time.perf_counter() - start) / len(queries)
+
+    near = [near_duplicate(rng, rng.choice(sources), vocabulary) for _ in range(args.queries)]
+    unrelated = [random_sentence(rng, vocabulary) for _ in range(args.queries)]
+    near_rate, near_time = run_queries(near)
+    unrelated_rate, unrelated_time = run_queries(unrelated)
+
+    start = time.perf_counter()
+    for text in near[:1000]:
+        backend.set(text, f"ZH:{text}")
+    backend.flush()
+    increment = (time.perf_counter() - start) / min(len(near), 1000)
+    backend.close()
+
+    print(f"📊 翻译记忆基准 (SQLite 持久化索引): {len(sources):,} 条，阈值 {args.threshold}，"
+          f"数据库 {db_file.stat().st_size / 1024 / 1024:.1f} MiB")
+    print(f"   首次构建: {build:.2f} 秒 ({build / args.entries * 1e6:.1f} µs/条)")
+    print(f"   之后启动 (打开数据库并取得索引): {reopen * 1000:.1f} ms")
+    print(f"   增量写入: {increment * 1e6:.1f} µs/条 (缓存与索引同一事务提交)")
+    print(f"   近似重复查询: 命中率 {near_rate * 100:.1f}%，{near_time * 1e6:.1f} µs/次")
+    print(f"   无关文本查询: 命中率 {unrelated_rate * 100:.1f}%，{unrelated_time * 1e6:.1f} µs/次")
+
+def write_corpus(out_dir: Path, files: int, cues: int, seed: int = 0, unique_ratio: float = 0.5) -> List[Path]:
+    """在 out_dir 中生成 files 个合成 SRT 文件，每个 cues 条字幕"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = out_dir / f"episode{i + 1:03d}.srt"
+        path.write_text(generate_srt(cues, seed=seed + i, unique_ratio=unique_ratio), encoding="utf-8")
+        paths.append(path)
+    return paths
+
+def bench_corpus(args):
+    paths = write_corpus(Path(args.out), args.files, args.cues, args.seed, args.unique_ratio)
+    print(f"✅ 已生成 {len(paths)} 个 SRT 文件 ({args.cues} 条字幕/文件) 于 {args.out}")
+
+def write_dictionary(path: Path, cues: List[main.Cue]):
+    """为离线词典后端生成覆盖语料全部台词的词典 (译文格式与模拟服务器一致)"""
+    texts = dict.fromkeys(cue.text for cue in cues if cue.text)
+    path.write_text("".join(f"{text}\tZH:{text}\n" for text in texts), encoding="utf-8")
+
+def bench_settings(base_url: str, **overrides) -> dict:
+    """指向模拟服务器的运行配置 (与 config.ini 的默认值一致)"""
+    settings = {
+        'api_key': "mock-key",
+        'api_keys': ["mock-key"],
+        'backend': "deepl",
+        'dictionary_file': str(main.DICTIONARY_FILE),
+        'source_lang': "EN",
+        'fuzzy_threshold': 0.0,
+        'translate_url': f"{base_url}/v2/translate",
+        'usage_url': f"{base_url}/v2/usage",
+        'target_lang': "ZH",
+        'sleep_time': 0,
+        'quota_threshold': 0.95,
+        'max_batch_chars': 45000,
+        'cache_flush_every': 50,
+        'cache_compact_mb': 8,
+        'cache_backend': "json",
+        'cache_db': str(main.CACHE_DB_FILE),
+        'concurrency': 1,
+        'requests_per_second': 0,
+        'rate_burst': 1,
+        'file_jobs': 4,
+        'pool_size': 4,
+        'compress_requests': False,
+        'max_retries': 5,
+        'retry_base_delay': 0.05,
+        'retry_max_delay': 1.0,
+    }
+    settings.update(overrides)
+    return settings
+
+def bench_run(args):
+    state = MockDeepLState(latency=args.latency, error_rate=args.error_rate, burst_every=args.burst_every,
+                           burst_length=args.burst_length, character_limit=args.character_limit, seed=args.seed)
+    server = start_mock_server(state)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    api_keys = [f"bench-key-{i}" for i in range(max(1, args.keys))]
+    settings = bench_settings(base_url, api_keys=api_keys, backend=args.backend,
+                              concurrency=args.concurrency, file_jobs=args.jobs,
+                              requests_per_second=args.rps, cache_backend=args.cache_backend,
+                              checkpoints=not args.no_checkpoints)
+
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="srt-bench-") as work_dir:
+        work = Path(work_dir)
+        if args.corpus:
+            files = [shutil.copy(path, work) for path in sorted(Path(args.corpus).glob("*.srt"))]
+            files = [Path(path) for path in files]
+        else:
+            files = write_corpus(work, args.files, args.cues, args.seed, args.unique_ratio)
+        corpus_cues = [cue for path in files
+                       for cue in main.iter_srt_cues(io.StringIO(path.read_text(encoding="utf-8")))]
+        total_cues = len(corpus_cues)
+
+        os.chdir(work)
+        if args.backend == "dictionary":
+            write_dictionary(work / settings['dictionary_file'], corpus_cues)
+        try:
+            api = main.create_translator(settings)
+        except EnvironmentError as e:
+            os.chdir(cwd)
+            server.shutdown()
+            print(f"🔴 无法创建翻译后端 {args.backend}: {e}")
+            return 1
+        cache = main.TranslationCache(main.create_cache_backend(settings))
+        output = sys.stdout if args.verbose else open(os.devnull, "w")
+        main.PROFILER.enabled = args.profile
+        main.PROFILER.reset()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(output):
+                if args.use_async:
+                    asyncio.run(main.process_srt_files_async(files, api, cache, settings))
+                else:
+                    main.process_srt_files(files, api, cache, settings)
+        except main.QuotaExceededError as e:
+            print(f"🔴 {e}")
+        finally:
+            cache.close()
+            api.close()
+            elapsed = time.perf_counter() - start
+            os.chdir(cwd)
+            if output is not sys.stdout:
+                output.close()
+            server.shutdown()
+
+    summary = state.summary()
+    print(f"📊 基准结果 ({api.name}): {len(files)} 个文件，{total_cues:,} 条字幕")
+    print(f"   总耗时: {elapsed:.2f} 秒")
+    print(f"   吞吐量: {total_cues / elapsed if elapsed else 0:,.0f} 条字幕/秒")
+    if args.profile:
+        main.PROFILER.print_report()
+    if api.billable:
+        print(f"   HTTP 请求数: {summary['requests']:,}  状态分布: {summary['statuses']}")
+        print(f"   计费字符数: {summary['character_count']:,}")
+        if len(api_keys) > 1:
+            print(f"   各 Key 用量: {summary['key_usage']}")
+
+MAIN_SCRIPT = Path(main.__file__).resolve()
+
+def timed_run(command: List[str], cwd: Path, env: dict) -> Tuple[float, float]:
+    """运行命令，返回 (到第一行输出的耗时, 总耗时)，单位毫秒"""
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdout.readline()
+    first_output = time.perf_counter() - start
+    process.stdout.read()
+    process.wait()
+    return first_output * 1000, (time.perf_counter() - start) * 1000
+
+def import_breakdown(env: dict, cwd: Path, args: List[str] | None = None) -> Tuple[float, List[Tuple[str, float]], set]:
+    """python -X importtime <args> (默认 -c "import main")：
+    返回 (main 的累计导入毫秒, 直接导入的模块耗时, 所有已导入模块)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", *(args or ["-c", "import main"])], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    total = 0.0
+    children: List[Tuple[str, float]] = []
+    pending: List[Tuple[str, float]] = []
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name_field = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        name = name_field.strip()
+        depth = (len(name_field) - len(name_field.lstrip()) - 1) // 2
+        modules.add(name)
+        # importtime 先输出子模块：紧接在某个顶层模块之前的第 1 层模块即为它直接导入的模块
+        if depth == 1:
+            pending.append((name, int(cumulative) / 1000))
+        elif depth == 0:
+            if name == "main":
+                total, children = int(cumulative) / 1000, pending
+            pending = []
+    return total, sorted(children, key=lambda item: -item[1]), modules
+
+def wait_for_job(job: "main.TranslationJob", timeout: float) -> str:
+    """等待任务结束 (done / failed)，超时返回当时的状态"""
+    deadline = time.monotonic() + timeout
+    while job.finished is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.status
+
+def bench_serve(args):
+    """任务接口的故障隔离：第一个任务收到 403 (唯一的 Key 被拒绝) 时只有该任务失败，
+    工作线程继续运行，下一个任务正常完成"""
+    state = MockDeepLState(forbidden_requests=1)
+    server = start_mock_server(state)
+    settings = bench_settings(f"http://127.0.0.1:{server.server_address[1]}", serve_jobs=1)
+    with tempfile.TemporaryDirectory(prefix="srt-serve-") as work_dir:
+        work = Path(work_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            api = main.create_checked_translator(settings)
+        cache = main.TranslationCache(main.JsonCacheBackend(work / "cache.json", work / "cache.journal"))
+        jobs_server = main.TranslationJobServer(api, cache, settings)
+        jobs_server.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                first, _ = jobs_server.submit("forbidden.srt", generate_srt(20, seed=1).encode("utf-8"))
+                first_status = wait_for_job(first, args.timeout)
+                second, _ = jobs_server.submit("next.srt", generate_srt(20, seed=2).encode("utf-8"))
+                second_status = wait_for_job(second, args.timeout)
+            alive = all(worker.is_alive() for worker in jobs_server.workers)
+        finally:
+            for _ in jobs_server.workers:
+                jobs_server.queue.put(None)
+            cache.close()
+            api.close()
+            server.shutdown()
+
+    print("📊 任务接口故障隔离 (唯一的 Key 第一次请求返回 403)")
+    print(f"   任务 1: {first_status}  ({first.error})")
+    print(f"   任务 2: {second_status}")
+    print(f"   工作线程存活: {'是' if alive else '否'}")
+    if first_status != "failed" or second_status != "done" or not alive:
+        print("\n⚠️ 预期任务 1 失败、任务 2 完成且工作线程存活")
+        return 1
+    print("\n✅ 403 只使当前任务失败，后续任务正常完成")
+
+def bench_startup(args):
+    cwd = Path.cwd()
+    state = MockDeepLState()
+    server = start_mock_server(state)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    with tempfile.TemporaryDirectory(prefix="srt-startup-") as work_dir:
+        work = Path(work_dir)
+        # 字节码缓存写到临时目录，与正常安装 (已有 __pycache__) 的启动情况一致
+        env = {**os.environ, "PYTHONUNBUFFERED": "1", "PYTHONPYCACHEPREFIX": str(work / "pycache"),
+               "PYTHONPATH": str(MAIN_SCRIPT.parent)}
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        (work / "config.ini").write_text(
+            f"[deepl]\napi_key = startup-key\ntranslate_url = {base_url}/v2/translate\n"
+            f"usage_url = {base_url}/v2/usage\n[settings]\nsleep_time = 0\nquota_threshold = 0.95\n"
+            # 关闭整文件存储：--force 时每个文件都重新解析并逐行查询缓存
+            "max_batch_chars = 45000\nfile_store = false\n", encoding="utf-8")
+        write_corpus(work, args.files, args.cues, args.seed)
+        # 先完整翻译一次：之后不带 --force 的运行全部命中增量检查，带 --force 的运行每一行都命中缓存
+        subprocess.run([sys.executable, str(MAIN_SCRIPT)], cwd=work, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        summary = state.summary()
+        requests_before = summary['requests'] + summary['usage_requests']
+
+        # 以 subtitle.sh 的方式 (python -m main，复用已编译的字节码) 运行时应低于 --max-ms
+        cache_only = f"纯缓存运行 (-m main --force，{args.files} 个文件)"
+        scenarios = {
+            "空解释器 (python -c pass)": [sys.executable, "-c", "pass"],
+            "main.py --help": [sys.executable, str(MAIN_SCRIPT), "--help"],
+            f"增量检查 ({args.files} 个文件均已最新)": [sys.executable, "-m", "main"],
+            "纯缓存运行 (main.py --force)": [sys.executable, str(MAIN_SCRIPT), "--force"],
+            cache_only: [sys.executable, "-m", "main", "--force"],
+        }
+        results = {}
+        for label, command in scenarios.items():
+            timed_run(command, work, env)  # 预热 (写入字节码缓存)
+            runs = [timed_run(command, work, env) for _ in range(args.repeat)]
+            results[label] = (statistics.median(first for first, _ in runs),
+                              statistics.median(total for _, total in runs))
+        total_import, children, _ = import_breakdown(env, MAIN_SCRIPT.parent)
+        _, _, modules = import_breakdown(env, work, [str(MAIN_SCRIPT), "--force"])
+        server.shutdown()
+    os.chdir(cwd)
+
+    print(f"📊 启动基准 (中位数，{args.repeat} 次)")
+    for label, (first, total) in results.items():
+        print(f"   {main.pad_display(label, 42)}首行输出 {first:7.1f} ms   总耗时 {total:7.1f} ms")
+    print(f"\n   import main: {total_import:.1f} ms (python -X importtime)，耗时最多的直接导入:")
+    for name, ms in children[:args.top]:
+        print(f"     {name:<28}{ms:7.1f} ms")
+    eager = sorted(name for name in ("requests", "chardet", "urllib3", "asyncio", "sqlite3") if name in modules)
+    print(f"   纯缓存运行加载的重量级模块: {', '.join(eager) if eager else '无'}")
+    summary = state.summary()
+    sent_requests = summary['requests'] + summary['usage_requests'] != requests_before
+    if sent_requests:
+        print("   ⚠️ 纯缓存运行发送了 HTTP 请求 (含 /v2/usage 配额查询)")
+
+    first, total = results[cache_only]
+    if sent_requests:
+        return 1
+    if total > args.max_ms:
+        print(f"\n⚠️ 纯缓存运行耗时 {total:.1f} ms，超过目标 {args.max_ms:g} ms")
+        return 1
+    print(f"\n✅ 纯缓存运行耗时 {total:.1f} ms，低于目标 {args.max_ms:g} ms")
+
+# 各编码的合成台词：(语料名, 编码, 写入的 BOM, 台词)
+ENCODING_KINDS = [
+    ("utf-8", "utf-8", b"", ["Where are you going?", "We need to talk about last night.", "Thank you, Zoë."]),
+    ("utf-8-sig", "utf-8", codecs.BOM_UTF8, ["你要去哪里？", "我们需要谈谈昨晚的事。", "谢谢。"]),
+    ("utf-16", "utf-16-le", codecs.BOM_UTF16_LE, ["你要去哪里？", "Où êtes-vous allé ?", "谢谢。"]),
+    ("cp1252", "cp1252", b"", ["Ça va très bien, merci.", "Où êtes-vous allé hier soir ?",
+                               "Je ne sais pas, c'est déjà trop tard.", "¿Dónde está el niño?"]),
+    ("gbk", "gbk", b"", ["你要去哪里？", "我们需要谈谈昨晚发生的事情。", "我不知道你在说什么。", "谢谢你，老朋友。"]),
+    ("shift_jis", "shift_jis", b"", ["どこへ行くの？", "昨夜のことを話さなければならない。", "わかりません。", "ありがとう。"]),
+]
+
+def encoded_srt(lines: List[str], encoding: str, bom: bytes, count: int, seed: int) -> Tuple[bytes, List[str]]:
+    """生成按 encoding 编码的 SRT 字节串与各条字幕的原文"""
+    rng = random.Random(seed)
+    texts = [f"{rng.choice(lines)} #{i}" for i in range(count)]
+    blocks = [f"{i + 1}\n{main.format_timestamp(i * 2500)} --> {main.format_timestamp(i * 2500 + 2000)}\n{text}\n"
+              for i, text in enumerate(texts)]
+    return bom + "\n".join(blocks).encode(encoding), texts
+
+def mixed_srt(count: int, seed: int) -> Tuple[bytes, List[str]]:
+    """前半为纯 ASCII、后半每四条含一条 UTF-8 法语台词并混入一条 cp1252 台词的 SRT (旧实现只看前 1024 字节)"""
+    rng = random.Random(seed)
+    english = ["Where are you going?", "I don't know.", "Thank you."]
+    french = ["Café au lait, s'il vous plaît.", "Où êtes-vous allé ?", "Ça va très bien."]
+    texts = [f"{rng.choice(french if i >= count // 2 and i % 4 == 0 else english)} #{i}" for i in range(count)]
+    stray = count * 3 // 4
+    texts[stray] = "Un café crème, très bien."
+    blocks = []
+    for i, text in enumerate(texts):
+        block = f"{i + 1}\n{main.format_timestamp(i * 2500)} --> {main.format_timestamp(i * 2500 + 2000)}\n{text}\n"
+        blocks.append(block.encode("cp1252" if i == stray else "utf-8"))
+    return b"\n".join(blocks), texts
+
+def late_srt(seed: int) -> Tuple[bytes, List[str]]:
+    """两倍检测样本长度的纯 ASCII 台词之后是三条 cp1252 法语台词的 SRT
+    (只检测开头样本时会被判为 ascii)"""
+    rng = random.Random(seed)
+    english = ["Where are you going?", "I don't know.", "We need to talk about last night."]
+    french = ["Ça va très bien, café.", "Où êtes-vous allé ?", "Je ne sais pas, c'est déjà trop tard."]
+    texts: List[str] = []
+    size = 0
+    while size < 2 * main.ENCODING_SAMPLE_BYTES:
+        texts.append(f"{rng.choice(english)} #{len(texts)}")
+        size += len(texts[-1]) + 50
+    texts += [f"{text} #{len(texts) + i}" for i, text in enumerate(french)]
+    blocks = [f"{i + 1}\n{main.format_timestamp(i * 2500)} --> {main.format_timestamp(i * 2500 + 2000)}\n{text}\n"
+              for i, text in enumerate(texts)]
+    return "\n".join(blocks).encode("cp1252"), texts
+
+def legacy_detect_file_encoding(file_path: Path) -> str:
+    """旧实现：chardet 只检测前 1024 字节，置信度不足时回退 iso-8859-1"""
+    with file_path.open("rb") as f:
+        result = main.chardet.detect(f.read(1024)) if main.chardet else {"encoding": None}
+    if result["encoding"] and result["confidence"] > 0.5:
+        return result["encoding"]
+    return "iso-8859-1"
+
+def decoded_accuracy(path: Path, encoding: str, texts: List[str], errors: str) -> int:
+    """按检测到的编码解析文件，返回与原文一致的字幕条数 (解码失败计 0)"""
+    try:
+        with path.open("r", encoding=encoding, errors=errors) as f:
+            cues = list(main.iter_srt_cues(f))
+    except (UnicodeError, LookupError):
+        return 0
+    return sum(cue.text == text for cue, text in zip(cues, texts))
+
+def bench_encoding(args):
+    detector = next((name for name in ("cchardet", "chardet", "charset_normalizer")
+                     if getattr(main, name) is not None), "无")
+    print(f"📊 编码检测基准: 每类 {args.files} 个文件 × {args.cues} 条字幕，检测库: {detector}")
+    # 预热：检测库的导入开销不计入单个文件的耗时
+    main.guess_encoding("Où êtes-vous allé ?".encode("cp1252"))
+    headers = ("语料", "旧实现准确率", "新实现准确率", "旧 ms/文件", "新 ms/文件", "缓存 µs/文件")
+    print(main.pad_display(headers[0], 12) + "".join(main.pad_display(h, 14, right=True) for h in headers[1:]))
+    kinds = [(name, lambda seed, e=encoding, b=bom, l=lines: encoded_srt(l, e, b, args.cues, seed))
+             for name, encoding, bom, lines in ENCODING_KINDS]
+    kinds.append(("mixed", lambda seed: mixed_srt(args.cues, seed)))
+    kinds.append(("late-cp1252", late_srt))
+    totals = [0, 0, 0]
+    with tempfile.TemporaryDirectory(prefix="srt-encoding-") as work_dir:
+        for name, generate in kinds:
+            files = []
+            for i in range(args.files):
+                data, texts = generate(args.seed + i)
+                path = Path(work_dir) / f"{name}-{i:03d}.srt"
+                path.write_bytes(data)
+                files.append((path, texts, main.file_sha256(path)))
+
+            main.ENCODING_CACHE.clear()
+            legacy_time = new_time = cached_time = 0.0
+            legacy_ok = new_ok = 0
+            for path, texts, content_hash in files:
+                start = time.perf_counter()
+                legacy = legacy_detect_file_encoding(path)
+                legacy_time += time.perf_counter() - start
+                start = time.perf_counter()
+                detected = main.detect_file_encoding(path, content_hash)
+                new_time += time.perf_counter() - start
+                start = time.perf_counter()
+                main.detect_file_encoding(path, content_hash)
+                cached_time += time.perf_counter() - start
+                # 旧实现以严格模式打开文件，新实现以 errors="replace" 打开
+                legacy_ok += decoded_accuracy(path, legacy, texts, "strict")
+                new_ok += decoded_accuracy(path, detected, texts, "replace")
+            cues = sum(len(texts) for _, texts, _ in files)
+            totals = [totals[0] + legacy_ok, totals[1] + new_ok, totals[2] + cues]
+            print(f"{name:<12}{legacy_ok / cues * 100:>13.1f}%{new_ok / cues * 100:>13.1f}%"
+                  f"{legacy_time / args.files * 1000:>14.2f}{new_time / args.files * 1000:>14.2f}"
+                  f"{cached_time / args.files * 1e6:>14.1f}")
+    print(f"\n   总体准确率: 旧实现 {totals[0] / totals[2] * 100:.1f}%，新实现 {totals[1] / totals[2] * 100:.1f}%")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="SRT 字幕翻译工具性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cues = sub.add_parser("cues", help="字幕解析与表示的单条开销")
+    cues.add_argument("--count", type=int, default=10000, help="合成字幕条数")
+    cues.add_argument("--repeat", type=int, default=5, help="重复次数 (取最快)")
+    cues.set_defaults(func=bench_cues)
+
+    tm = sub.add_parser("tm", help="翻译记忆索引的构建与近似查询开销")
+    tm.add_argument("--entries", type=int, default=200000, help="记忆库条目数")
+    tm.add_argument("--queries", type=int, default=2000, help="每类查询的次数")
+    tm.add_argument("--threshold", type=float, default=0.8, help="近似匹配阈值")
+    tm.add_argument("--seed", type=int, default=0, help="随机种子")
+    tm.add_argument("--sqlite", action="store_true", help="测量 SQLite 缓存后端的持久化索引 (首次构建、之后启动与查询)")
+    tm.set_defaults(func=bench_tm)
+
+    corpus = sub.add_parser("corpus", help="生成合成 SRT 语料")
+    corpus.add_argument("--out", required=True, help="输出目录")
+    corpus.set_defaults(func=bench_corpus)
+
+    run = sub.add_parser("run", help="对本地模拟 DeepL 运行完整翻译流程")
+    run.add_argument("--corpus", help="已有的 SRT 语料目录 (默认临时生成)")
+    run.add_argument("--latency", type=float, default=0.05, help="模拟请求延迟 (秒)")
+    run.add_argument("--error-rate", type=float, default=0.0, help="模拟 503 错误率")
+    run.add_argument("--burst-every", type=int, default=0, help="每 N 个请求出现一次 429 突发")
+    run.add_argument("--burst-length", type=int, default=1, help="429 突发连续的请求数")
+    run.add_argument("--character-limit", type=int, default=10**9, help="模拟的每个 Key 字符配额")
+    run.add_argument("--keys", type=int, default=1, help="模拟的 API Key 数量")
+    run.add_argument("--backend", default="deepl", choices=["deepl", "dictionary", "argos"],
+                     help="翻译后端 (dictionary 使用由语料生成的词典；argos 需要已安装语言模型)")
+    run.add_argument("--concurrency", type=int, default=1, help="并发翻译批次数")
+    run.add_argument("--jobs", type=int, default=4, help="并行读写的文件数")
+    run.add_argument("--rps", type=float, default=0, help="每秒请求数上限 (0 为不限速)")
+    run.add_argument("--cache-backend", default="json", choices=["json", "sqlite"])
+    run.add_argument("--async", dest="use_async", action="store_true", help="使用 asyncio 流水线")
+    run.add_argument("--no-checkpoints", action="store_true", help="不记录断点清单 (对比断点续传的开销)")
+    run.add_argument("--profile", action="store_true", help="打印各阶段耗时与计数")
+    run.add_argument("-v", "--verbose", action="store_true", help="显示翻译过程输出")
+    run.set_defaults(func=bench_run)
+
+    startup = sub.add_parser("startup", help="启动耗时：python -X importtime 与首行输出/纯缓存运行的耗时")
+    startup.add_argument("--repeat", type=int, default=7, help="每个场景的运行次数 (取中位数)")
+    startup.add_argument("--top", type=int, default=8, help="列出耗时最多的前 N 个导入")
+    startup.add_argument("--max-ms", type=float, default=100, help="纯缓存运行的目标总耗时 (毫秒)，超出时返回 1")
+    startup.add_argument("--files", type=int, default=20, help="合成文件数")
+    startup.add_argument("--cues", type=int, default=200, help="每个文件的字幕条数")
+    startup.add_argument("--seed", type=int, default=0, help="随机种子")
+    startup.set_defaults(func=bench_startup)
+
+    serve = sub.add_parser("serve", help="任务接口的故障隔离检查：403 的任务标记为失败，后续任务仍完成")
+    serve.add_argument("--timeout", type=float, default=30, help="每个任务的最长等待时间 (秒)")
+    serve.set_defaults(func=bench_serve)
+
+    encoding = sub.add_parser("encoding", help="混合编码语料上的编码检测准确率与耗时 (旧实现对比)")
+    encoding.add_argument("--files", type=int, default=10, help="每类编码的文件数")
+    encoding.add_argument("--cues", type=int, default=500, help="每个文件的字幕条数")
+    encoding.add_argument("--seed", type=int, default=0, help="随机种子")
+    encoding.set_defaults(func=bench_encoding)
+
+    for command in (corpus, run):
+        command.add_argument("--files", type=int, default=20, help="合成文件数")
+        command.add_argument("--cues", type=int, default=500, help="每个文件的字幕条数")
+        command.add_argument("--unique-ratio", type=float, default=0.5, help="不可去重台词的比例")
+        command.add_argument("--seed", type=int, default=0, help="随机种子")
+
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(args.func(args))
@@ -1,26 +1,119 @@
+from __future__ import annotations
+
 import sys
 import os
 import re
 import time
 import json
 import configparser
-import requests
 import importlib.util
-import chardet
-import subprocess
+import hashlib
+import argparse
+import random
+import threading
+import queue
+import contextlib
+import itertools
+import codecs
+import unicodedata
+import zlib
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import Tuple, Dict
+from urllib.parse import parse_qs, quote, quote_plus, urlencode
+from typing import Tuple, Dict, List, Iterable, Iterator, Callable
 from datetime import datetime, timezone 
 
+def lazy_import(name: str):
+    """延迟导入：返回的模块在首次访问属性时才真正加载；未安装时返回 None。
+
+    requests (约占启动时间的八成)、chardet 等只在真正用到时才付出导入开销，
+    --help、离线后端与全部命中缓存的运行因此启动更快。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        # 与普通 import 一致：子模块同时作为父包的属性 (asyncio 等依赖 concurrent.futures 属性)
+        setattr(sys.modules[parent], child, module)
+    return module
+
+requests = lazy_import("requests")
+chardet = lazy_import("chardet")
+cchardet = lazy_import("cchardet")
+charset_normalizer = lazy_import("charset_normalizer")
+asyncio = lazy_import("asyncio")
+sqlite3 = lazy_import("sqlite3")
+gzip = lazy_import("gzip")
+concurrent_futures = lazy_import("concurrent.futures")
+
 # --- 常量 ---
+TOOL_VERSION = "1.2.0"
 CACHE_FILE = Path("cache.json")
+CACHE_JOURNAL_FILE = Path("cache.journal")
+CACHE_DB_FILE = Path("cache.sqlite3")
+BUILD_STATE_FILE = Path("build_state.json")
+FILE_STORE_DIR = Path("file_store")
+DICTIONARY_FILE = Path("dictionary.tsv")
 CONFIG_FILE = Path("config.ini")
+# HTTP 任务接口最多保留的任务数 (超出时丢弃最早完成的任务及其结果)
+SERVE_MAX_JOBS = 1000
 REQUIRED_LIBRARIES = ["requests", "chardet", "configparser"]
+# DeepL 单次请求限制：最多 50 段 text，请求体最大 128 KiB
+DEEPL_MAX_TEXTS = 50
+DEEPL_MAX_REQUEST_BYTES = 128 * 1024
+# 编码检测：BOM (UTF-32 须在 UTF-16 之前判断)、检测库读取的样本大小、无法判断时的回退编码
+ENCODING_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+ENCODING_SAMPLE_BYTES = 64 * 1024
+ENCODING_FALLBACK = "iso-8859-1"
+# 内容哈希 -> 检测到的编码 (同一进程内复用，超出上限时丢弃最早的记录)
+ENCODING_CACHE: Dict[str, str] = {}
+ENCODING_CACHE_SIZE = 4096
+# 请求体中除 text 外的固定部分 (auth_key、target_lang 等) 预留字节数
+REQUEST_BASE_BYTES = 1024
+# 请求体超过此大小时才进行 gzip 压缩 (需开启 compress_requests)
+GZIP_MIN_BYTES = 1024
+FAILED_TRANSLATION = "【翻译失败或原文为空】"
+# 原文中不参与翻译的标记：[音效]、{\an8} 等
+MARKUP_PATTERN = re.compile(r"\[.*?\]|\{.*?\}")
+# SRT 时间轴行，容忍多余空白、1~2 位小时以及 "." 毫秒分隔符
+SRT_TIMESTAMP_PATTERN = re.compile(
+    r"^\s*(\d{1,2}):(\d{2}):(\d{2})[,.](\d{1,3})\s*-->\s*(\d{1,2}):(\d{2}):(\d{2})[,.](\d{1,3})"
+)
+CANONICAL_TIMING_PATTERN = re.compile(r"\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d\Z")
+# 可重试的 HTTP 状态码 (429 请求过多、5xx 服务器错误)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+# 翻译记忆：字符 n-gram 长度、LSH 分段数 × 每段 MinHash 行数、参与近似匹配的最短文本
+TM_NGRAM = 3
+TM_BANDS = 4
+TM_ROWS = 3
+TM_MIN_CHARS = 8
+TM_QUOTE_TABLE = str.maketrans({"’": "'", "‘": "'", "“": '"', "”": '"'})
+TM_TRAILING_PATTERN = re.compile(r"[\s.…。]+$")
+# 持久化索引的格式版本 (规范化、分段或哈希方式变化时加 1，旧索引会被重建)
+TM_INDEX_VERSION = 1
+TM_BAND_MULTIPLIER = 0x100000001B3
+MASK64 = (1 << 64) - 1
+MASK63 = (1 << 63) - 1
 
 # --- 实用功能：环境检查与编码检测 ---
 
 def check_and_install_dependencies():
-    """检查并安装依赖库"""
+    """检查并安装依赖库 (--setup)"""
+    import subprocess
     missing = [lib for lib in REQUIRED_LIBRARIES if not importlib.util.find_spec(lib)]
     
     if missing:
@@ -35,17 +128,138 @@ def check_and_install_dependencies():
                 print(f"❌ 无法安装 {pkg}。请手动安装:")
                 print(f"   {sys.executable} -m pip install {pkg}")
                 sys.exit(1)
+    else:
+        print("✅ 依赖库均已安装。")
 
-def detect_file_encoding(file_path: Path) -> str:
-    """检测文件编码"""
+def missing_dependencies(settings: dict) -> List[str]:
+    """本次运行需要但未安装的依赖库 (不做安装，安装见 --setup)"""
+    # 编码检测库任选其一 (cchardet、chardet 或 charset-normalizer)，都没有时提示安装 chardet
+    needed = {"chardet": cchardet or chardet or charset_normalizer}
+    if settings.get('backend', 'deepl') == 'deepl':
+        needed["requests"] = requests
+    return [name for name, module in needed.items() if module is None]
+
+def detect_file_encoding(file_path: Path, content_hash: str | None = None) -> str:
+    """检测文件编码：BOM → 整个文件严格按 UTF-8 校验 → 编码检测库 (样本取开头与第一个非法字节附近)。
+
+    指定 content_hash 时按内容哈希缓存结果，同一内容只检测一次。
+    """
+    if content_hash is not None and content_hash in ENCODING_CACHE:
+        return ENCODING_CACHE[content_hash]
     try:
         with file_path.open("rb") as f:
-            result = chardet.detect(f.read(1024))
-            if result["encoding"] and result["confidence"] > 0.5:
-                return result["encoding"]
-    except Exception:
-        pass
-    return "iso-8859-1"
+            head = f.read(ENCODING_SAMPLE_BYTES)
+            encoding = bom_encoding(head)
+            if encoding is None:
+                # 流式校验，不必将整个文件读入内存
+                decoder = codecs.getincrementaldecoder("utf-8")()
+                position = 0
+                chunk = head
+                try:
+                    while True:
+                        # 非法字节的位置：已送入的字节数 - 解码器中缓存的不完整字符 + 本次的出错位置
+                        buffered = len(decoder.getstate()[0])
+                        if not chunk:
+                            decoder.decode(b"", final=True)
+                            break
+                        decoder.decode(chunk)
+                        position += len(chunk)
+                        chunk = f.read(1024 * 1024)
+                    encoding = "utf-8"
+                except UnicodeDecodeError as e:
+                    def read_at(start: int, size: int) -> bytes:
+                        f.seek(start)
+                        return f.read(size)
+                    encoding = guess_encoding(sample_around(head, position - buffered + e.start, read_at))
+    except OSError:
+        encoding = ENCODING_FALLBACK
+    return remember_encoding(content_hash, encoding)
+
+def detect_text_encoding(data: bytes, content_hash: str | None = None) -> str:
+    """检测字节串的编码 (规则同 detect_file_encoding)"""
+    if content_hash is not None and content_hash in ENCODING_CACHE:
+        return ENCODING_CACHE[content_hash]
+    encoding = bom_encoding(data)
+    if encoding is None:
+        try:
+            data.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError as e:
+            encoding = guess_encoding(sample_around(data[:ENCODING_SAMPLE_BYTES], e.start,
+                                                    lambda start, size: data[start:start + size]))
+    return remember_encoding(content_hash, encoding)
+
+def sample_around(head: bytes, offset: int, read_at: Callable[[int, int], bytes]) -> bytes:
+    """编码检测库的样本：UTF-8 校验在 offset 处失败。
+
+    失败位置在开头样本之内时直接用开头样本；否则从失败位置所在行的行首 (read_at(起点, 长度) 读取)
+    取同样长度的片段。只看开头时，前面全是 ASCII 台词的文件会被判为 ascii，后面的非 ASCII 台词
+    全部变成替换字符；把开头的 ASCII 台词也放进样本则会稀释检测库的统计，同样容易误判。
+    """
+    if offset < len(head):
+        return head
+    start = max(0, offset - 1024)
+    window = read_at(start, offset - start + ENCODING_SAMPLE_BYTES)
+    return window[window.rfind(b"\n", 0, offset - start) + 1:]
+
+def bom_encoding(head: bytes) -> str | None:
+    """按字节顺序标记 (BOM) 识别编码"""
+    for bom, encoding in ENCODING_BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+def guess_encoding(sample: bytes) -> str:
+    """用已安装的编码检测库猜测非 UTF-8 样本的编码。
+
+    优先 cchardet (C 实现)；charset-normalizer 对字幕这类短句常把 cp1252、Shift-JIS 误判为
+    cp1257、CP949 (见 benchmark.py encoding)，因此只在未安装 chardet 时使用。
+    置信度不足但样本能按该多字节编码完整解码时 (如 chardet 对 GBK 字幕的置信度常低于 0.5)，
+    仍比回退到 iso-8859-1 更可靠；单字节编码几乎能解码任意字节，低置信度的单字节结果
+    (短的 cp1252 台词常被猜成 ISO-8859-4/13) 不如直接回退。
+    """
+    if mostly_utf8(sample):
+        return "utf-8"
+    detector = cchardet or chardet or charset_normalizer
+    if detector is not None:
+        result = detector.detect(sample)
+        encoding = result["encoding"]
+        # 调用方已确认存在非 ASCII 字节，ascii 的结果说明样本没有覆盖到它们，不可采用
+        if (encoding and codec_name(encoding) not in (None, "ascii")
+                and (result["confidence"] > 0.5 or decodes_as_multibyte(sample, encoding))):
+            return encoding
+    return ENCODING_FALLBACK
+
+def mostly_utf8(sample: bytes) -> bool:
+    """样本中合法的 UTF-8 非 ASCII 字符多于非法字节：按 UTF-8 读取 (混入少量其他编码的台词以替换字符显示)。
+
+    单字节编码 (cp1252 等) 的文本几乎不会恰好构成合法的 UTF-8 多字节序列。
+    """
+    text = sample.decode("utf-8", errors="replace")
+    non_ascii = len(text) - len(text.encode("ascii", errors="ignore"))
+    return non_ascii > 2 * text.count("\ufffd")
+
+def codec_name(encoding: str) -> str | None:
+    """编码名的规范形式 (如 "US-ASCII" → "ascii")；Python 不支持的编码返回 None"""
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+def decodes_as_multibyte(sample: bytes, encoding: str) -> bool:
+    """样本能否按 encoding 严格解码，且确实含有多字节字符 (样本末尾被截断的多字节字符不算错误)"""
+    try:
+        text = codecs.getincrementaldecoder(encoding)().decode(sample)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return len(text) < len(sample)
+
+def remember_encoding(content_hash: str | None, encoding: str) -> str:
+    if content_hash is not None:
+        if len(ENCODING_CACHE) >= ENCODING_CACHE_SIZE:
+            del ENCODING_CACHE[next(iter(ENCODING_CACHE))]
+        ENCODING_CACHE[content_hash] = encoding
+    return encoding
 
 # --- 配置加载 (整合所有配置) ---
 
@@ -59,17 +273,64 @@ def load_config_settings(config_file: Path) -> dict:
     
     settings = {}
     try:
+        # 翻译后端：deepl (默认) 或离线的 dictionary / argos，离线后端不需要 DeepL 的 Key 与端点
+        settings['backend'] = config.get("settings", "backend", fallback="deepl").strip()
+        deepl_fallback = {} if settings['backend'] == 'deepl' else {'fallback': ""}
+
         # DeepL Section
-        settings['api_key'] = config.get("deepl", "api_key").strip()
-        settings['translate_url'] = config.get("deepl", "translate_url").strip()
-        settings['usage_url'] = config.get("deepl", "usage_url").strip()
+        settings['api_key'] = config.get("deepl", "api_key", **deepl_fallback).strip()
+        # 可选的多个 Key (逗号或换行分隔)，与 api_key 一起组成密钥池
+        extra_keys = re.split(r"[,\s]+", config.get("deepl", "api_keys", fallback=""))
+        settings['api_keys'] = list(dict.fromkeys(k for k in [settings['api_key'], *extra_keys] if k))
+        settings['translate_url'] = config.get("deepl", "translate_url", **deepl_fallback).strip()
+        settings['usage_url'] = config.get("deepl", "usage_url", **deepl_fallback).strip()
+        settings['target_lang'] = config.get("deepl", "target_lang", fallback="ZH").strip()
         
         # Settings Section
         settings['sleep_time'] = config.getfloat("settings", "sleep_time")
         settings['quota_threshold'] = config.getfloat("settings", "quota_threshold")
         settings['max_batch_chars'] = config.getint("settings", "max_batch_chars")
+        settings['concurrency'] = max(1, config.getint("settings", "concurrency", fallback=1))
+        # 未配置 requests_per_second 时沿用 sleep_time：每秒最多 1 / sleep_time 个请求
+        default_rps = 1 / settings['sleep_time'] if settings['sleep_time'] > 0 else 0
+        settings['requests_per_second'] = config.getfloat("settings", "requests_per_second", fallback=default_rps)
+        settings['rate_burst'] = config.getint("settings", "rate_burst", fallback=1)
+        settings['checkpoints'] = config.getboolean("settings", "checkpoints", fallback=True)
+        settings['quota_strategy'] = config.get("settings", "quota_strategy", fallback="shortest").strip()
+        if settings['quota_strategy'] not in ("shortest", "priority", "order"):
+            raise EnvironmentError(f"配置文件 {config_file} 中 quota_strategy 只能为 shortest / priority / order。")
+        settings['file_store'] = config.getboolean("settings", "file_store", fallback=True)
+        settings['file_store_max_mb'] = config.getfloat("settings", "file_store_max_mb", fallback=100)
+        settings['file_jobs'] = max(1, config.getint("settings", "file_jobs", fallback=4))
+        settings['pool_size'] = config.getint("settings", "pool_size", fallback=max(4, settings['concurrency']))
+        settings['compress_requests'] = config.getboolean("settings", "compress_requests", fallback=False)
+        settings['max_retries'] = config.getint("settings", "max_retries", fallback=5)
+        settings['retry_base_delay'] = config.getfloat("settings", "retry_base_delay", fallback=1.0)
+        settings['retry_max_delay'] = config.getfloat("settings", "retry_max_delay", fallback=60.0)
+        settings['cache_flush_every'] = config.getint("settings", "cache_flush_every", fallback=50)
+        settings['cache_compact_mb'] = config.getfloat("settings", "cache_compact_mb", fallback=8)
+        settings['cache_backend'] = config.get("settings", "cache_backend", fallback="json").strip()
+        settings['cache_db'] = config.get("settings", "cache_db", fallback=str(CACHE_DB_FILE)).strip()
+        settings['dictionary_file'] = config.get("settings", "dictionary_file", fallback=str(DICTIONARY_FILE)).strip()
+        settings['source_lang'] = config.get("settings", "source_lang", fallback="EN").strip()
+        settings['fuzzy_threshold'] = config.getfloat("settings", "fuzzy_threshold", fallback=0.0)
+        if not 0 <= settings['fuzzy_threshold'] <= 1:
+            raise EnvironmentError(f"配置文件 {config_file} 中 fuzzy_threshold 应在 0 ~ 1 之间 (0 为关闭)。")
+        # Prometheus 指标导出：端口为 0、文件为空时关闭
+        settings['metrics_port'] = config.getint("settings", "metrics_port", fallback=0)
+        settings['metrics_host'] = config.get("settings", "metrics_host", fallback="127.0.0.1").strip()
+        settings['metrics_textfile'] = config.get("settings", "metrics_textfile", fallback="").strip()
+        settings['metrics_interval'] = config.getfloat("settings", "metrics_interval", fallback=15.0)
+        # 监视模式 (--watch)：轮询间隔与文件写入完成的判定时间
+        settings['watch_interval'] = config.getfloat("settings", "watch_interval", fallback=5.0)
+        settings['watch_debounce'] = config.getfloat("settings", "watch_debounce", fallback=2.0)
+        # HTTP 任务接口 (--serve)
+        settings['serve_host'] = config.get("settings", "serve_host", fallback="127.0.0.1").strip()
+        settings['serve_port'] = config.getint("settings", "serve_port", fallback=8000)
+        settings['serve_jobs'] = max(1, config.getint("settings", "serve_jobs", fallback=2))
+        settings['serve_max_mb'] = config.getfloat("settings", "serve_max_mb", fallback=20)
 
-        if not settings['api_key']:
+        if settings['backend'] == 'deepl' and not settings['api_keys']:
              raise EnvironmentError(f"配置文件 {config_file} 中 [deepl] 部分的 api_key 不能为空。")
 
     except configparser.Error as e:
@@ -79,57 +340,756 @@ def load_config_settings(config_file: Path) -> dict:
     
     return settings
 
-# --- DeepL API 交互 ---
+# --- 性能统计 ---
+
+# 阶段名称 -> 报告中的显示名称
+STAGE_LABELS = {
+    "hash": "文件哈希",
+    "encoding": "编码检测",
+    "parse": "解析",
+    "checkpoint_load": "断点恢复",
+    "file_store": "整文件存储",
+    "cache_lookup": "缓存查询",
+    "translation_memory": "翻译记忆",
+    "translate": "翻译 (后端合计)",
+    "rate_limit_wait": "  限速等待",
+    "http_request": "  HTTP 请求",
+    "retry_backoff": "  重试退避",
+    "cache_flush": "缓存写盘",
+    "checkpoint_save": "断点保存",
+    "write": "写出",
+    "build_state": "构建状态保存",
+}
+# 计数器名称 -> 报告中的显示名称
+COUNTER_LABELS = {
+    "requests": "HTTP 请求",
+    "retries": "重试",
+    "request_bytes": "请求体字节",
+    "billed_chars": "计费字符",
+    "cache_hits": "缓存命中",
+    "cache_misses": "缓存未命中",
+    "tm_saved_chars": "翻译记忆节省字符",
+    "bytes_read": "读取字节",
+    "bytes_written": "写出字节",
+}
+
+# 同时记录直方图的阶段耗时 (秒) 与计数 (字节) 及其桶上限
+HISTOGRAM_BUCKETS = {
+    "http_request": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    "translate": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    "request_bytes": (1024, 4096, 16384, 65536, 131072),
+}
+
+def pad_display(text: str, width: int, right: bool = False) -> str:
+    """按终端显示宽度 (中文占两列) 补空格；right 为 True 时右对齐"""
+    used = sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+    padding = " " * max(0, width - used)
+    return padding + text if right else text + padding
+
+class _StageTimer:
+    __slots__ = ("profiler", "name", "file", "start")
+
+    def __init__(self, profiler: "Profiler", name: str, file: Path | None):
+        self.profiler = profiler
+        self.name = name
+        self.file = file
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start, self.file)
+        return False
+
+class Profiler:
+    """轻量级的阶段计时与计数注册表 (--profile)
+
+    stage(name, file) 为上下文管理器，累计该阶段的耗时与调用次数；count(name, value, file) 累加计数；
+    gauge(name, value, **labels) 记录当前值。指定 file 时同时计入该文件的明细；HISTOGRAM_BUCKETS 中的
+    阶段与计数另外按桶统计分布。未启用时 stage() 返回共享的空上下文、count() / gauge() 直接返回。
+    多线程阶段的耗时为各线程累计值，可能超过总耗时。
+    """
+    _NULL = contextlib.nullcontext()
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.files: Dict[str, Dict[str, float]] = {}
+        # 名称 -> [各桶计数, 总和, 次数]
+        self.histograms: Dict[str, list] = {}
+        self.gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    def stage(self, name: str, file: Path | None = None):
+        if not self.enabled:
+            return self._NULL
+        return _StageTimer(self, name, file)
+
+    def add_time(self, name: str, seconds: float, file: Path | None = None):
+        with self._lock:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+            if name in HISTOGRAM_BUCKETS:
+                self._observe(name, seconds)
+            if file is not None:
+                per_file = self.files.setdefault(str(file), {})
+                per_file[name] = per_file.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: float = 1, file: Path | None = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if name in HISTOGRAM_BUCKETS:
+                self._observe(name, value)
+            if file is not None:
+                per_file = self.files.setdefault(str(file), {})
+                per_file[name] = per_file.get(name, 0) + value
+
+    def gauge(self, name: str, value: float, **labels: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def _observe(self, name: str, value: float):
+        buckets = HISTOGRAM_BUCKETS[name]
+        histogram = self.histograms.setdefault(name, [[0] * len(buckets), 0.0, 0])
+        for i, upper in enumerate(buckets):
+            if value <= upper:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def report(self) -> dict:
+        """以字典形式返回本次运行与各文件的统计 (用于 JSON 输出)"""
+        with self._lock:
+            return {
+                "wall_seconds": round(time.perf_counter() - self.started, 6),
+                "stages": {name: {"seconds": round(seconds, 6), "calls": calls}
+                           for name, (seconds, calls) in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: {"buckets": dict(zip(HISTOGRAM_BUCKETS[name], counts)),
+                                      "sum": total, "count": calls}
+                               for name, (counts, total, calls) in self.histograms.items()},
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in self.gauges.items()],
+                "files": {name: dict(values) for name, values in self.files.items()},
+            }
+
+    def print_report(self):
+        report = self.report()
+        wall = report["wall_seconds"]
+        print(f"\n⏱️ 性能分析 (总耗时 {wall:.2f} 秒；多线程阶段为累计耗时)")
+        print(f"   {pad_display('阶段', 18)}{pad_display('耗时(秒)', 10, True)}"
+              f"{pad_display('次数', 10, True)}{pad_display('占比', 10, True)}")
+        for name, label in STAGE_LABELS.items():
+            stage = report["stages"].get(name)
+            if stage:
+                share = stage["seconds"] / wall * 100 if wall else 0
+                print(f"   {pad_display(label, 18)}{stage['seconds']:>10.3f}{stage['calls']:>10,}{share:>9.1f}%")
+
+        counters = report["counters"]
+        parts = [f"{label} {counters[name]:,.0f}" for name, label in COUNTER_LABELS.items() if name in counters]
+        statuses = sorted(name for name in counters if name.startswith("status_"))
+        if statuses:
+            parts.append("状态码 " + ", ".join(f"{name[7:]}×{counters[name]:,.0f}" for name in statuses))
+        if parts:
+            print("   计数: " + "，".join(parts))
+
+        if report["files"]:
+            print(f"\n   {pad_display('文件', 28)}{pad_display('读取解析(秒)', 14)}{pad_display('写出(秒)', 10)}"
+                  f"{pad_display('读取字节', 12)}{pad_display('缓存命中/未命中', 18)}待翻译字符")
+            for name, values in sorted(report["files"].items()):
+                read = sum(values.get(key, 0) for key in ("hash", "encoding", "parse", "checkpoint_load"))
+                hits = f"{values.get('cache_hits', 0):,.0f}/{values.get('cache_misses', 0):,.0f}"
+                print(f"   {pad_display(Path(name).name[:26], 28)}{read:<14.3f}{values.get('write', 0):<10.3f}"
+                      f"{values.get('bytes_read', 0):<12,.0f}{hits:<18}{values.get('pending_chars', 0):,.0f}")
+
+    def write_json(self, json_file: Path):
+        with json_file.open("w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+PROFILER = Profiler()
+
+# --- 指标导出 ---
+
+METRICS_PREFIX = "srt_translate_"
+# 计数器名称 -> (Prometheus 指标名, 说明)
+METRIC_COUNTERS = {
+    "requests": ("http_requests_total", "发送的翻译 HTTP 请求数"),
+    "retries": ("retries_total", "翻译请求的重试次数"),
+    "request_bytes": ("request_bytes_total", "翻译请求体字节数"),
+    "billed_chars": ("billed_characters_total", "成功翻译的计费字符数"),
+    "cache_hits": ("cache_hits_total", "缓存命中的文本数"),
+    "cache_misses": ("cache_misses_total", "缓存未命中的文本数"),
+    "tm_saved_chars": ("translation_memory_saved_characters_total", "翻译记忆节省的字符数"),
+    "bytes_read": ("read_bytes_total", "读取的字幕文件字节数"),
+    "bytes_written": ("written_bytes_total", "写出的字幕文件字节数"),
+}
+# 直方图名称 -> (Prometheus 指标名, 说明)
+METRIC_HISTOGRAMS = {
+    "http_request": ("http_request_duration_seconds", "单个翻译 HTTP 请求的耗时"),
+    "translate": ("batch_duration_seconds", "单个翻译批次的耗时 (含限速等待与重试)"),
+    "request_bytes": ("request_size_bytes", "翻译请求体大小"),
+}
+# 仪表名称 -> 说明
+METRIC_GAUGES = {
+    "quota_remaining_characters": "DeepL 剩余字符配额 (按 Key)",
+    "quota_limit_characters": "DeepL 字符配额上限 (按 Key)",
+    "queue_depth": "待处理队列深度",
+}
+
+def format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+             for key, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def render_metrics(profiler: Profiler) -> str:
+    """以 Prometheus 文本格式 (0.0.4) 输出 profiler 中的计数、直方图与仪表"""
+    report = profiler.report()
+    lines = []
+
+    def header(name: str, kind: str, help_text: str):
+        lines.append(f"# HELP {METRICS_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+    counters = report["counters"]
+    for key, (name, help_text) in METRIC_COUNTERS.items():
+        header(name, "counter", help_text)
+        lines.append(f"{METRICS_PREFIX}{name} {format_metric_value(counters.get(key, 0))}")
+
+    header("http_responses_total", "counter", "按状态码统计的翻译 HTTP 响应数")
+    for key in sorted(key for key in counters if key.startswith("status_")):
+        labels = format_labels([("code", key[len("status_"):])])
+        lines.append(f"{METRICS_PREFIX}http_responses_total{labels} {format_metric_value(counters[key])}")
+
+    lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+    header("cache_hit_ratio", "gauge", "缓存命中率")
+    lines.append(f"{METRICS_PREFIX}cache_hit_ratio {format_metric_value(counters.get('cache_hits', 0) / lookups if lookups else 0)}")
+
+    header("stage_seconds_total", "counter", "各阶段累计耗时")
+    for stage, values in sorted(report["stages"].items()):
+        lines.append(f"{METRICS_PREFIX}stage_seconds_total{format_labels([('stage', stage)])} "
+                     f"{format_metric_value(round(values['seconds'], 6))}")
+    header("stage_calls_total", "counter", "各阶段调用次数")
+    for stage, values in sorted(report["stages"].items()):
+        lines.append(f"{METRICS_PREFIX}stage_calls_total{format_labels([('stage', stage)])} {values['calls']}")
+
+    for key, (name, help_text) in METRIC_HISTOGRAMS.items():
+        header(name, "histogram", help_text)
+        histogram = report["histograms"].get(key, {"buckets": dict.fromkeys(HISTOGRAM_BUCKETS[key], 0),
+                                                   "sum": 0, "count": 0})
+        for upper, count in histogram["buckets"].items():
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{format_labels([('le', format_metric_value(upper))])} {count}")
+        lines.append(f'{METRICS_PREFIX}{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+        lines.append(f"{METRICS_PREFIX}{name}_sum {format_metric_value(round(histogram['sum'], 6))}")
+        lines.append(f"{METRICS_PREFIX}{name}_count {histogram['count']}")
+
+    gauges = report["gauges"]
+    for name, help_text in METRIC_GAUGES.items():
+        samples = [gauge for gauge in gauges if gauge["name"] == name]
+        if samples:
+            header(name, "gauge", help_text)
+            for gauge in samples:
+                lines.append(f"{METRICS_PREFIX}{name}{format_labels(sorted(gauge['labels'].items()))} "
+                             f"{format_metric_value(gauge['value'])}")
+    return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """Prometheus 指标导出：HTTP 端点 (/metrics) 和/或 node_exporter textfile
+
+    启动时启用 profiler；未配置端口与文件时不创建，统计代码保持空操作。
+    textfile 每 interval 秒原子写入一次，关闭时再写入最终值。
+    """
+    def __init__(self, profiler: Profiler, port: int = 0, textfile: Path | None = None,
+                 interval: float = 15.0, host: str = "127.0.0.1"):
+        self.profiler = profiler
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.host = host
+        self.server = None
+        self._stop = threading.Event()
+        self._writer: threading.Thread | None = None
+
+    def start(self):
+        self.profiler.enabled = True
+        if self.port:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            profiler = self.profiler
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def log_message(self, format, *args):
+                    pass
+
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/metrics", "/"):
+                        self.send_error(404)
+                        return
+                    body = render_metrics(profiler).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            self.server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"📈 指标端点: http://{self.host}:{self.server.server_address[1]}/metrics")
+        if self.textfile:
+            self._writer = threading.Thread(target=self._write_periodically, daemon=True)
+            self._writer.start()
 
-class DeepLAPI:
-    """DeepL API 交互类"""
-    def __init__(self, api_key: str, settings: dict):
-        self.api_key = api_key
+    def _write_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.write_textfile()
+
+    def write_textfile(self):
+        tmp_file = self.textfile.with_name(self.textfile.name + ".tmp")
+        try:
+            tmp_file.write_text(render_metrics(self.profiler), encoding="utf-8")
+            os.replace(tmp_file, self.textfile)
+        except OSError as e:
+            print(f"\n⚠️ 写入指标文件 {self.textfile} 失败: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self.textfile:
+            self.write_textfile()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+# --- 批次规划 ---
+
+def request_text_bytes(text: str) -> int:
+    """估算一段文本在 form 请求体中占用的字节数 (含 "&text=" 前缀)"""
+    return len(quote_plus(text)) + 6
+
+def plan_batches(texts: List[str], max_chars: int = 45000, max_texts: int = DEEPL_MAX_TEXTS,
+                 max_bytes: int = DEEPL_MAX_REQUEST_BYTES) -> List[List[str]]:
+    """按字符数、段数和请求体字节数三个上限，将文本顺序打包为若干批次。"""
+    batches = []
+    current: List[str] = []
+    current_chars = 0
+    current_bytes = REQUEST_BASE_BYTES
+
+    for text in texts:
+        text_chars = len(text)
+        text_bytes = request_text_bytes(text)
+        if current and (len(current) >= max_texts
+                        or current_chars + text_chars > max_chars
+                        or current_bytes + text_bytes > max_bytes):
+            batches.append(current)
+            current, current_chars, current_bytes = [], 0, REQUEST_BASE_BYTES
+        current.append(text)
+        current_chars += text_chars
+        current_bytes += text_bytes
+
+    if current:
+        batches.append(current)
+    return batches
+
+# --- 限速 ---
+
+class RateLimiter:
+    """令牌桶限速器（线程安全）
+
+    以 rate 个/秒的速度补充令牌，桶容量为 burst。acquire() 在没有令牌时阻塞等待，
+    rate <= 0 表示不限速。
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# --- 重试策略 ---
+
+class QuotaExceededError(Exception):
+    """DeepL 配额已用尽 (HTTP 456)，应在批次边界停止"""
+
+class AuthError(RuntimeError):
+    """DeepL 拒绝了 API Key (HTTP 403) 且没有其他可用的 Key；命令行模式下由 main() 退出"""
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略"""
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """第 attempt 次失败后的等待秒数；服务器给出 Retry-After 时以其为准"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+def remaining_char_budget(api: "Translator", quota_threshold: float) -> int | None:
+    """配额阈值以内的剩余可计费字符数 (不计费的后端返回 None)，按最近一次用量查询与之后的计费字符计算"""
+    if not api.billable:
+        return None
+    used, limit = api.tracked_usage()
+    return max(0, int(limit * quota_threshold) - used)
+
+def resolve_char_budget(char_budget: int | Callable[[], int | None] | None) -> int | None:
+    """字符预算可以延迟求值：传入函数时在确有待翻译文本时才调用 (需要创建翻译后端并查询配额)"""
+    return char_budget() if callable(char_budget) else char_budget
+
+class CharacterBudget:
+    """本次运行可计费字符数的预算 (线程安全)，在批次边界检查"""
+    def __init__(self, remaining: int):
+        self.remaining = remaining
+        self._lock = threading.Lock()
+
+    def consume(self, chars: int) -> bool:
+        """预算足够时扣除并返回 True，否则不扣除并返回 False"""
+        with self._lock:
+            if chars > self.remaining:
+                return False
+            self.remaining -= chars
+            return True
+
+# --- 翻译后端 ---
+
+class Translator:
+    """翻译后端接口
+
+    子类实现 _translate_batch (单个请求内的批量翻译)，并通过类属性声明能力：
+    max_texts / max_request_bytes 为单次请求的段数与请求体上限，billable 表示是否按字符计费
+    (决定是否进行配额检查与字符预算)。
+    """
+    name = "base"
+    max_texts = DEEPL_MAX_TEXTS
+    max_request_bytes = DEEPL_MAX_REQUEST_BYTES
+    billable = False
+
+    def __init__(self, settings: dict):
         self.settings = settings
 
+    def translate(self, text: str) -> str:
+        """翻译文本"""
+        if not text.strip():
+            return ""
+        return self.translate_many([text])[0]
+
+    def translate_many(self, texts: List[str], stats: dict | None = None) -> List[str]:
+        """批量翻译多段文本，返回与输入一一对应的译文列表。
+
+        按 max_texts / max_request_bytes / max_batch_chars 自动拆分为多个请求。
+        失败或空白原文对应的位置返回空字符串。stats 不为 None 时累加请求尝试次数。
+        配额耗尽时抛出 QuotaExceededError。
+        """
+        results = [""] * len(texts)
+        pending = [i for i, text in enumerate(texts) if text.strip()]
+        chunks = self.plan_batches([texts[i] for i in pending])
+
+        offset = 0
+        for chunk in chunks:
+            indices = pending[offset:offset + len(chunk)]
+            offset += len(chunk)
+            with PROFILER.stage("translate"):
+                translated_chunk = self._translate_batch(chunk, stats)
+            for i, translated in zip(indices, translated_chunk):
+                results[i] = translated
+        return results
+
+    def plan_batches(self, texts: List[str]) -> List[List[str]]:
+        """按本后端的请求上限打包批次"""
+        return plan_batches(texts, max_chars=self.settings.get('max_batch_chars', 45000),
+                            max_texts=self.max_texts, max_bytes=self.max_request_bytes)
+
+    def _translate_batch(self, texts: List[str], stats: dict | None = None) -> List[str]:
+        raise NotImplementedError
+
+    def get_usage(self) -> Tuple[int, int, float, str]:
+        """返回 (已用字符, 字符上限, 使用比例, 重置日期)；不计费的后端没有配额"""
+        return 0, 0, 0.0, "未知"
+
+    def tracked_usage(self) -> Tuple[int, int]:
+        """不发送请求，返回本地记录的 (已用字符, 字符上限)"""
+        return 0, 0
+
+    def close(self):
+        pass
+
+# --- DeepL API 交互 ---
+
+def endpoint_for_key(url: str, key: str) -> str:
+    """DeepL Free Key (以 ":fx" 结尾) 与 Pro Key 使用不同域名；自定义地址保持不变"""
+    if key.endswith(":fx"):
+        return url.replace("://api.deepl.com/", "://api-free.deepl.com/")
+    return url.replace("://api-free.deepl.com/", "://api.deepl.com/")
+
+class ApiKeyState:
+    """密钥池中单个 API Key 的端点、用量与可用状态"""
+    def __init__(self, key: str, settings: dict, rate_limiter: RateLimiter):
+        self.key = key
+        self.translate_url = endpoint_for_key(settings['translate_url'], key)
+        self.usage_url = endpoint_for_key(settings['usage_url'], key)
+        self.rate_limiter = rate_limiter
+        self.used = 0
+        self.limit = 0
+        self.in_flight = 0
+        self.active = True
+
+    @property
+    def label(self) -> str:
+        return f"…{self.key[-6:]}"
+
+    @property
+    def remaining(self) -> float:
+        return self.limit - self.used - self.in_flight if self.limit else float("inf")
+
+class DeepLAPI(Translator):
+    """DeepL API 交互类
+
+    利用 DeepL 可重复的 text 参数，每个请求最多 DEEPL_MAX_TEXTS 段、
+    请求体不超过 DEEPL_MAX_REQUEST_BYTES。
+
+    可持有多个 API Key：每个批次路由到剩余配额最多的 Key，各 Key 使用独立的限速器
+    并发请求；某个 Key 返回 456 (配额用尽) 或 403 (被拒绝) 时自动停用并切换到其他 Key。
+    """
+    name = "deepl"
+    billable = True
+
+    def __init__(self, api_key: str | List[str], settings: dict, rate_limiter: RateLimiter | None = None):
+        super().__init__(settings)
+        keys = [api_key] if isinstance(api_key, str) else list(api_key)
+        self.api_key = keys[0]
+        self.keys = [
+            ApiKeyState(key, settings, rate_limiter or RateLimiter(
+                settings.get('requests_per_second', 0), settings.get('rate_burst', 1)
+            ))
+            for key in keys
+        ]
+        self._key_lock = threading.Lock()
+        self.session = self._create_session(settings.get('pool_size', 4))
+        self.retry_policy = RetryPolicy(
+            max_attempts=settings.get('max_retries', 5),
+            base_delay=settings.get('retry_base_delay', 1.0),
+            max_delay=settings.get('retry_max_delay', 60.0),
+        )
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """创建复用连接的 HTTP 会话 (keep-alive + 连接池 + gzip 响应压缩)"""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def _select_key(self, chars: int) -> ApiKeyState:
+        """选择剩余配额最多的可用 Key，并预占本次请求的字符数 (避免并发请求扎堆同一个 Key)"""
+        with self._key_lock:
+            active = [state for state in self.keys if state.active]
+            if not active:
+                raise QuotaExceededError("所有 DeepL API Key 均已不可用 (配额用尽或被拒绝)。")
+            # 未查询过用量 (limit 未知) 时按已用与在途字符数分摊
+            state = max(active, key=lambda state: (state.remaining, -(state.used + state.in_flight)))
+            state.in_flight += chars
+            return state
+
+    def _release_key(self, state: ApiKeyState, chars: int, billed: bool = False):
+        with self._key_lock:
+            state.in_flight -= chars
+            if billed:
+                state.used += chars
+                if state.limit:
+                    self._record_quota(state)
+
+    @staticmethod
+    def _record_quota(state: ApiKeyState):
+        PROFILER.gauge("quota_remaining_characters", max(0, state.limit - state.used), key=state.label)
+        PROFILER.gauge("quota_limit_characters", state.limit, key=state.label)
+
+    def _retire_key(self, state: ApiKeyState, response: requests.Response, endpoint_name: str):
+        """停用返回 456 / 403 的 Key；没有其他可用 Key 时按单 Key 的方式报错
+
+        最后一个 Key 返回 403 时保持启用：抛出 AuthError 后，任务接口的后续任务仍会再尝试。
+        """
+        with self._key_lock:
+            has_fallback = any(other.active for other in self.keys if other is not state)
+            if has_fallback or response.status_code == 456:
+                state.active = False
+
+        if response.status_code == 456:
+            if not has_fallback:
+                raise QuotaExceededError(f"DeepL 配额已用尽 (456 Quota Exceeded): {response.text[:150]}")
+            print(f"\n⚠️ API Key {state.label} 配额已用尽 (456)，切换到其他 Key。")
+        else:
+            if not has_fallback:
+                self._handle_error(response, endpoint_name)
+            print(f"\n⚠️ API Key {state.label} 被拒绝 (403 Forbidden)，已停用并切换到其他 Key。")
+
     def _handle_error(self, response: requests.Response, endpoint_name: str):
-        """通用错误处理，特别是针对 403 错误立即退出。"""
+        """通用错误处理：403 抛出 AuthError (不在此处退出)，其他错误状态抛出 HTTPError。"""
         if response.status_code == 403:
             print(f"\n🔴 DeepL API 致命错误 (403 Forbidden) 在 {endpoint_name} 请求中。")
             print("原因通常是 API Key 无效、格式错误（例如被引号包裹）或已被吊销。")
-            print(f"请检查 config.ini 中 [deepl] -> api_key 的值。")
+            print("请检查 config.ini 中 [deepl] -> api_key 的值。")
             print(f"DeepL 错误响应: {response.text[:150]}...")
-            sys.exit(1)
+            raise AuthError(f"DeepL 拒绝了 API Key (403 Forbidden): {response.text[:150]}")
         
         response.raise_for_status()
 
+    def _translate_batch(self, texts: List[str], stats: dict | None = None) -> List[str]:
+        """发送单个翻译请求 (texts 已满足数量与大小限制)，按重试策略处理临时错误"""
+        policy = self.retry_policy
+        chars = sum(len(text) for text in texts)
+        error = ""
+        attempt = 0
+        while attempt < policy.max_attempts:
+            state = self._select_key(chars)
+            data = {
+                "auth_key": state.key,
+                "text": texts,
+                "target_lang": self.settings.get('target_lang', 'ZH')
+            }
+            body = urlencode(data, doseq=True).encode("utf-8")
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+            if self.settings.get('compress_requests') and len(body) >= GZIP_MIN_BYTES:
+                body = gzip.compress(body)
+                headers["Content-Encoding"] = "gzip"
 
-    def translate(self, text: str) -> str:
-        """翻译文本"""
-        if not text.strip():
-            return ""
-
-        data = {
-            "auth_key": self.api_key,
-            "text": text,
-            "target_lang": "ZH"
-        }
+            if stats is not None:
+                stats['attempts'] = stats.get('attempts', 0) + 1
+            retry_after = None
+            billed = False
+            try:
+                with PROFILER.stage("rate_limit_wait"):
+                    state.rate_limiter.acquire()
+                with PROFILER.stage("http_request"):
+                    response = self.session.post(state.translate_url, data=body, headers=headers, timeout=30)
+                PROFILER.count("requests")
+                PROFILER.count("request_bytes", len(body))
+                PROFILER.count(f"status_{response.status_code}")
+                if response.status_code in (403, 456):
+                    # 切换 Key 不计入重试次数
+                    self._retire_key(state, response, "翻译")
+                    continue
+                if response.status_code in RETRY_STATUS_CODES:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    error = f"HTTP {response.status_code}"
+                else:
+                    self._handle_error(response, "翻译")
+                    try:
+                        translations = [t["text"] for t in response.json()["translations"]]
+                        if not all(isinstance(text, str) for text in translations):
+                            raise TypeError("text 字段不是字符串")
+                    except (ValueError, KeyError, TypeError) as e:
+                        # 200 响应但内容不符合预期 (缺少 translations / text 字段等)，与数量不匹配一样按失败处理
+                        print(f"\n❌ 翻译响应格式无效: {e!r}")
+                        return [""] * len(texts)
+                    if len(translations) != len(texts):
+                        print(f"\n❌ 翻译结果数量不匹配: 发送 {len(texts)} 段，返回 {len(translations)} 段。")
+                        return [""] * len(texts)
+                    billed = True
+                    PROFILER.count("billed_chars", chars)
+                    return translations
+            except requests.exceptions.HTTPError as e:
+                # 其他 4xx 错误重试无意义
+                print(f"\n❌ 翻译请求失败: {e}")
+                return [""] * len(texts)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            finally:
+                self._release_key(state, chars, billed)
 
-        try:
-            response = requests.post(self.settings['translate_url'], data=data, timeout=10)
-            self._handle_error(response, "翻译")
-            translated = response.json()["translations"][0]["text"]
-            time.sleep(self.settings['sleep_time'])
-            return translated
-        except requests.exceptions.RequestException as e:
-            print(f"\n❌ 翻译请求失败: {e}")
-            return ""
+            attempt += 1
+            if attempt < policy.max_attempts:
+                delay = policy.backoff(attempt, retry_after)
+                print(f"\n⚠️ 翻译请求失败 ({error})，{delay:.1f} 秒后重试 ({attempt}/{policy.max_attempts})...")
+                PROFILER.count("retries")
+                with PROFILER.stage("retry_backoff"):
+                    time.sleep(delay)
 
+        print(f"\n❌ 翻译请求失败，已尝试 {policy.max_attempts} 次: {error}")
+        return [""] * len(texts)
 
     def get_usage(self) -> Tuple[int, int, float, str]:
-        """获取 API 使用量信息 (用于配额检查)"""
-        response = requests.get(self.settings['usage_url'], params={"auth_key": self.api_key}, timeout=5)
-        self._handle_error(response, "用量查询")
-        
-        data = response.json()
+        """获取 API 使用量信息 (用于配额检查)；多个 Key 时返回所有可用 Key 的合计"""
+        used = limit = 0
+        reset_date_str = "未知"
+        for state in list(self.keys):
+            if not state.active:
+                continue
+            response = self.session.get(state.usage_url, params={"auth_key": state.key}, timeout=5)
+            if response.status_code == 403:
+                self._retire_key(state, response, "用量查询")
+                continue
+            self._handle_error(response, "用量查询")
+            key_used, key_limit, key_reset = self._parse_usage(response.json())
+            with self._key_lock:
+                state.used, state.limit = key_used, key_limit
+                self._record_quota(state)
+            used += key_used
+            limit += key_limit
+            if reset_date_str == "未知":
+                reset_date_str = key_reset
+
+        percentage = (used / limit) if limit else 0
+        return used, limit, percentage, reset_date_str
+
+    def tracked_usage(self) -> Tuple[int, int]:
+        """最近一次 get_usage 的结果加上之后成功计费的字符数 (可用 Key 合计)"""
+        with self._key_lock:
+            active = [state for state in self.keys if state.active]
+            return sum(state.used for state in active), sum(state.limit for state in active)
+
+    @staticmethod
+    def _parse_usage(data: dict) -> Tuple[int, int, str]:
         used = data.get("character_count", 0)
         limit = data.get("character_limit", 500000)
-        percentage = (used / limit) if limit else 0
         
         # --- 提取并格式化重置日期 ---
         # 尝试获取 period_end_time (新字段) 或 end_time (旧字段/Pro字段)
@@ -152,208 +1112,2371 @@ class DeepLAPI:
                 # 如果解析失败，则保持 "未知"
                 pass
             
-        return used, limit, percentage, reset_date_str
+        return used, limit, reset_date_str
             
+# --- 离线翻译后端 ---
+
+class DictionaryTranslator(Translator):
+    """离线词典 / 翻译记忆后端：只使用本地词典文件中的译文，不访问网络。
+
+    词典文件为 UTF-8 的 TSV (每行 "原文<TAB>译文") 或 JSON 对象 {原文: 译文}；
+    原文按 normalize_cache_key 规范化后匹配，未收录的文本视为翻译失败。
+    """
+    name = "dictionary"
+    max_texts = 1000
+    max_request_bytes = 16 * 1024 * 1024
+
+    def __init__(self, settings: dict):
+        super().__init__(settings)
+        dictionary_file = Path(settings.get('dictionary_file', DICTIONARY_FILE))
+        if not dictionary_file.exists():
+            raise EnvironmentError(f"词典文件 {dictionary_file} 未找到 (backend = dictionary)。")
+        self.entries = self.load_entries(dictionary_file)
+
+    @staticmethod
+    def load_entries(dictionary_file: Path) -> Dict[str, str]:
+        if dictionary_file.suffix.lower() == ".json":
+            with dictionary_file.open("r", encoding="utf-8") as f:
+                pairs = list(json.load(f).items())
+        else:
+            with dictionary_file.open("r", encoding="utf-8-sig") as f:
+                pairs = [line.rstrip("\r\n").split("\t", 1) for line in f if "\t" in line]
+        return {normalize_cache_key(source): target.strip()
+                for source, target in pairs if source.strip() and target.strip()}
+
+    def _translate_batch(self, texts: List[str], stats: dict | None = None) -> List[str]:
+        if stats is not None:
+            stats['attempts'] = stats.get('attempts', 0) + 1
+        return [self.entries.get(normalize_cache_key(text), "") for text in texts]
+
+class ArgosTranslator(Translator):
+    """离线神经机器翻译后端 (Argos Translate，CPU 运行，可选依赖)。
+
+    需要 pip install argostranslate，并安装 source_lang -> target_lang 的语言模型包。
+    """
+    name = "argos"
+    max_texts = 16
+
+    def __init__(self, settings: dict):
+        super().__init__(settings)
+        try:
+            from argostranslate import translate as argos_translate
+        except ImportError:
+            raise EnvironmentError("backend = argos 需要可选依赖 argostranslate: "
+                                   f"{sys.executable} -m pip install argostranslate") from None
+        source = settings.get('source_lang', 'EN').lower().split("-")[0]
+        target = settings.get('target_lang', 'ZH').lower().split("-")[0]
+        languages = {language.code: language for language in argos_translate.get_installed_languages()}
+        translation = None
+        if source in languages and target in languages:
+            translation = languages[source].get_translation(languages[target])
+        if translation is None:
+            raise EnvironmentError(f"未安装 Argos Translate 的 {source} -> {target} 语言模型包。")
+        self.translation = translation
+
+    def _translate_batch(self, texts: List[str], stats: dict | None = None) -> List[str]:
+        if stats is not None:
+            stats['attempts'] = stats.get('attempts', 0) + 1
+        results = []
+        for text in texts:
+            try:
+                results.append(self.translation.translate(text))
+            except Exception as e:
+                print(f"\n❌ 离线翻译失败: {e}")
+                results.append("")
+        return results
+
+def create_translator(settings: dict) -> Translator:
+    """根据配置 backend (deepl / dictionary / argos) 创建翻译后端。"""
+    backend = settings.get('backend', 'deepl')
+    if backend == 'deepl':
+        return DeepLAPI(settings['api_keys'], settings)
+    if backend == 'dictionary':
+        return DictionaryTranslator(settings)
+    if backend == 'argos':
+        return ArgosTranslator(settings)
+    raise EnvironmentError(f"未知的翻译后端: {backend}（可选 deepl / dictionary / argos）")
+
 # --- 缓存管理 ---
 
-class TranslationCache:
-    """翻译缓存管理类"""
-    def __init__(self):
+def normalize_cache_key(text: str) -> str:
+    """缓存键规范化：去除首尾空白并合并连续空白。"""
+    return " ".join(text.split())
+
+class CacheBackend:
+    """缓存存储后端接口"""
+    def get(self, text: str) -> str | None:
+        raise NotImplementedError
+
+    def set(self, text: str, translation: str):
+        raise NotImplementedError
+
+    def set_many(self, items: Iterable[Tuple[str, str]]):
+        for text, translation in items:
+            self.set(text, translation)
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """遍历全部 (原文, 译文) 条目 (用于构建翻译记忆索引)"""
+        return iter(())
+
+    def translation_memory(self, threshold: float) -> "TranslationMemory | None":
+        """返回持久化的翻译记忆索引；不支持时返回 None，由 TranslationCache 在内存中构建"""
+        return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+class JsonCacheBackend(CacheBackend):
+    """JSON 文件缓存后端
+
+    持久化由两部分组成：cache.json 快照 + cache.journal 追加日志（每行一个 JSON 条目）。
+    set() 只追加到内存缓冲区，每 flush_every 条写入日志并 fsync 一次；
+    日志超过 compact_bytes 或正常退出 (close) 时合并为新的快照。
+    加载时先读快照再重放日志，崩溃最多丢失最后一组未刷新的条目。
+    """
+    def __init__(self, cache_file: Path = CACHE_FILE, journal_file: Path = CACHE_JOURNAL_FILE,
+                 flush_every: int = 50, compact_bytes: int = 8 * 1024 * 1024):
+        self.cache_file = cache_file
+        self.journal_file = journal_file
+        self.flush_every = max(1, flush_every)
+        self.compact_bytes = compact_bytes
+        self._pending: List[str] = []
         self.cache: Dict[str, str] = self._load_cache()
+        self._replay_journal()
 
     def _load_cache(self) -> Dict[str, str]:
-        if CACHE_FILE.exists():
+        if self.cache_file.exists():
             try:
-                with CACHE_FILE.open("r", encoding="utf-8") as f:
+                with self.cache_file.open("r", encoding="utf-8") as f:
                     return json.load(f)
             except json.JSONDecodeError:
                 return {}
         return {}
 
+    def _replay_journal(self):
+        """重放追加日志。最后一行可能因崩溃而不完整，直接忽略。"""
+        if not self.journal_file.exists():
+            return
+        with self.journal_file.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self.cache[entry["k"]] = entry["v"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+
+    def flush(self):
+        """将缓冲区中的新条目追加到日志并 fsync；日志过大时触发合并。"""
+        self._append_pending()
+        if self.journal_file.exists() and self.journal_file.stat().st_size > self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """将内存中的完整缓存写为新快照（原子替换），然后清空日志。"""
+        tmp_file = self.cache_file.with_suffix(".json.tmp")
+        with tmp_file.open("w", encoding="utf-8") as f:
+            json.dump(self.cache, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.cache_file)
+        # 快照已包含日志中的全部条目；即使在此处崩溃，重放日志也是幂等的
+        self.journal_file.unlink(missing_ok=True)
+
     def save(self):
-        with CACHE_FILE.open("w", encoding="utf-8") as f:
-            json.dump(self.cache, f, ensure_ascii=False, indent=2)
+        """刷新缓冲区并合并为快照。"""
+        self._append_pending()
+        self.compact()
+
+    def _append_pending(self):
+        if self._pending:
+            with self.journal_file.open("a", encoding="utf-8") as f:
+                f.write("".join(self._pending))
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending = []
+
+    def close(self):
+        """正常退出时调用：持久化所有条目并合并日志。"""
+        if self._pending or self.journal_file.exists():
+            self.save()
 
     def get(self, text: str) -> str | None:
         return self.cache.get(text)
 
+    def items(self) -> Iterator[Tuple[str, str]]:
+        return iter(list(self.cache.items()))
+
     def set(self, text: str, translation: str):
+        if self.cache.get(text) == translation:
+            return
         self.cache[text] = translation
-        self.save()
+        self._pending.append(json.dumps({"k": text, "v": translation}, ensure_ascii=False) + "\n")
+        if len(self._pending) >= self.flush_every:
+            self.flush()
 
-# --- SRT 文件处理 ---
+class SqliteCacheBackend(CacheBackend):
+    """SQLite 缓存后端
 
-def process_srt_file(file_path: Path, api: DeepLAPI, cache: TranslationCache, settings: dict):
-    """处理单个SRT文件，采用批量（Chunk-Based）翻译"""
-    print(f"\n🎬 正在处理文件: {file_path.name}")
-    
-    SPLIT_TOKEN = "<DEEPL_SPLIT_TOKEN>" 
-    MAX_CHARS = settings.get('max_batch_chars', 45000)
-    
-    try:
-        encoding = detect_file_encoding(file_path)
-        content = file_path.read_text(encoding=encoding)
-        
-        blocks = re.split(r"(\d+\n\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}\n)", content.strip()) 
-        blocks = blocks[1:]
-        
-        indexed_blocks = [blocks[i] + blocks[i+1] for i in range(0, len(blocks), 2)]
-        total = len(indexed_blocks)
-        
-        batches = []
-        current_batch_text = ""
-        current_batch_indices = []
-        
-        all_translations = {} 
+    主键为 (规范化原文的 SHA-1, 目标语言)，启动时无需加载全部条目，查询走主键索引。
+    使用 WAL 模式；写入在内存中分组，每 flush_every 条提交一次事务。
 
-        for idx, block in enumerate(indexed_blocks):
-            lines = block.split("\n")
-            if len(lines) < 2:
-                continue
+    翻译记忆索引保存在同一数据库的 tm_entries / tm_bands 表中：某个目标语言首次使用近似匹配时
+    由已有条目构建一次 (tm_state 记录索引版本)，之后每次提交缓存时在同一事务中增量更新。
+    """
+    def __init__(self, db_file: Path = CACHE_DB_FILE, target_lang: str = "ZH", flush_every: int = 50):
+        self.db_file = db_file
+        self.target_lang = target_lang
+        self.flush_every = max(1, flush_every)
+        self._pending: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " key_hash TEXT NOT NULL,"
+            " target_lang TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " translation TEXT NOT NULL,"
+            " PRIMARY KEY (key_hash, target_lang)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tm_entries ("
+            " id INTEGER PRIMARY KEY,"
+            " target_lang TEXT NOT NULL,"
+            " normalized TEXT NOT NULL,"
+            " translation TEXT NOT NULL"
+            ")"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tm_bands ("
+            " band_key INTEGER NOT NULL,"
+            " entry INTEGER NOT NULL,"
+            " PRIMARY KEY (band_key, entry)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS tm_state (target_lang TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+        self._tm_indexed = self._tm_index_current()
 
-            index, timestamp, *text_lines = lines
-            english_text = re.sub(r"\[.*?\]|\{.*?\}", "", " ".join(text_lines)).strip()
-            
-            cached_translation = cache.get(english_text)
-            if cached_translation is not None:
-                all_translations[english_text] = cached_translation
-                continue
-            
-            text_to_add = english_text + SPLIT_TOKEN
-            
-            if len(current_batch_text) + len(text_to_add) > MAX_CHARS and current_batch_text:
-                batches.append((current_batch_text, current_batch_indices))
-                current_batch_text = ""
-                current_batch_indices = []
-            
-            current_batch_text += text_to_add
-            current_batch_indices.append(english_text)
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha1(normalize_cache_key(text).encode("utf-8")).hexdigest()
 
-        if current_batch_text:
-            batches.append((current_batch_text, current_batch_indices))
+    def get(self, text: str) -> str | None:
+        key_hash = self._hash(text)
+        with self._lock:
+            pending = self._pending.get(key_hash)
+            if pending is not None:
+                return pending[1]
+            row = self.conn.execute(
+                "SELECT translation FROM translations WHERE key_hash = ? AND target_lang = ?",
+                (key_hash, self.target_lang),
+            ).fetchone()
+        return row[0] if row else None
 
-        
-        print(f"📦 翻译批次总数: {len(batches)}")
-        
-        for batch_idx, (batch_text, original_texts) in enumerate(batches):
-            sys.stdout.write(f"\r⚙️ 正在翻译批次 {batch_idx + 1}/{len(batches)}...")
-            sys.stdout.flush()
+    def items(self) -> Iterator[Tuple[str, str]]:
+        self.flush()
+        cursor = self.conn.execute(
+            "SELECT source, translation FROM translations WHERE target_lang = ?", (self.target_lang,)
+        )
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(10000)
+            if not rows:
+                return
+            yield from rows
 
-            translated_batch_text = api.translate(batch_text)
+    def set(self, text: str, translation: str):
+        with self._lock:
+            self._pending[self._hash(text)] = (text, translation)
+            should_flush = len(self._pending) >= self.flush_every
+        if should_flush:
+            self.flush()
 
-            if translated_batch_text:
-                translated_segments = translated_batch_text.split(SPLIT_TOKEN)
-                
-                for i, original_text in enumerate(original_texts):
-                    if i < len(translated_segments) and translated_segments[i].strip():
-                        translation = translated_segments[i].strip()
-                        all_translations[original_text] = translation
-                        cache.set(original_text, translation)
-            
-            else:
-                print(f"\n❌ 批次 {batch_idx + 1} 翻译失败或返回空结果。")
+    def set_many(self, items: Iterable[Tuple[str, str]]):
+        with self._lock:
+            for text, translation in items:
+                self._pending[self._hash(text)] = (text, translation)
+        self.flush()
 
-        new_blocks = []
-        for idx, block in enumerate(indexed_blocks):
-            lines = block.split("\n")
-            if len(lines) < 2:
-                new_blocks.append(block)
-                continue
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(key_hash, self.target_lang, text, translation)
+                    for key_hash, (text, translation) in self._pending.items()]
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO translations (key_hash, target_lang, source, translation) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                # 其他进程可能已在本进程启动后建立了索引
+                if self._tm_indexed or self._tm_index_current():
+                    self._tm_indexed = True
+                    self._write_tm(self._pending.values())
+            self._pending = {}
 
-            index, timestamp, *text_lines = lines
-            english_text = re.sub(r"\[.*?\]|\{.*?\}", "", " ".join(text_lines)).strip()
-            
-            translated = all_translations.get(english_text)
-            
-            if not translated:
-                translated = cache.get(english_text) or "【翻译失败或原文为空】"
+    def close(self):
+        self.flush()
+        self.conn.close()
 
-            original_lines = [l for l in text_lines if l.strip()]
-            new_block = [index, timestamp, *original_lines, translated]
-            new_blocks.append("\n".join(new_block))
-            
-            progress_bar = f"[{'#' * int((idx + 1) / total * 20):20}]"
-            sys.stdout.write(f"\r✅ 进度: {progress_bar} {((idx + 1) / total)*100:.1f}% ({idx + 1}/{total})")
-            sys.stdout.flush()
+    # --- 持久化翻译记忆索引 ---
 
+    def _tm_index_current(self) -> bool:
+        row = self.conn.execute(
+            "SELECT version FROM tm_state WHERE target_lang = ?", (self.target_lang,)
+        ).fetchone()
+        return row is not None and row[0] == TM_INDEX_VERSION
 
-        output_file = file_path.with_suffix(".zh.srt")
-        output_file.write_text("\n\n".join(new_blocks) + "\n\n", encoding="utf-8")
-        print(f"\n🎉 翻译完成! 输出文件: {output_file.name}")
+    def tm_entry_id(self, normalized: str) -> int:
+        """条目编号：目标语言 + 规范化原文的 63 位哈希，插入前无需查询"""
+        digest = hashlib.blake2b(f"{self.target_lang}\0{normalized}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") & MASK63
 
-    except Exception as e:
-        print(f"\n❌ 处理 {file_path.name} 失败: {e}")
+    def _write_tm(self, items: Iterable[Tuple[str, str]]):
+        """在当前事务中写入翻译记忆条目与桶键 (调用方持有锁)"""
+        entries, bands = [], []
+        for text, translation in items:
+            normalized = TranslationMemory.normalize(text)
+            entry = self.tm_entry_id(normalized)
+            entries.append((entry, self.target_lang, normalized, translation))
+            if TranslationMemory.indexable(normalized):
+                bands.extend((key, entry) for key in TranslationMemory.band_keys(normalized))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tm_entries (id, target_lang, normalized, translation) VALUES (?, ?, ?, ?)",
+            entries,
+        )
+        self.conn.executemany("INSERT OR IGNORE INTO tm_bands (band_key, entry) VALUES (?, ?)", bands)
 
-# --- 主函数 ---
-def main():
-    print("✨ SRT 批量翻译工具 ✨")
-    
-    # 1. 环境检查
-    try:
-        check_and_install_dependencies()
-        settings = load_config_settings(CONFIG_FILE)
-    except Exception as e:
-        print(f"🔴 启动失败: {e}")
-        sys.exit(1)
-        
-    # 2. 初始化 API 和检查配额
-    try:
-        api = DeepLAPI(settings['api_key'], settings)
-        
-        used, limit, percentage, reset_date_str = api.get_usage()
-        
-        quota_threshold = settings['quota_threshold']
-        
-        # --- 优化输出逻辑 ---
-        
-        if reset_date_str == "未知":
-            # 免费套餐不提供重置日期，提供清晰提示
-            reset_output = "DeepL API 免费套餐不提供确切重置日期。请登录 DeepL 账户门户查看。"
-        else:
-            reset_output = f"配额重置日期: {reset_date_str}."
+    def _build_tm(self):
+        """由该目标语言的全部缓存条目 (重新) 构建翻译记忆索引"""
+        start = time.perf_counter()
+        count = 0
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM tm_bands WHERE entry IN (SELECT id FROM tm_entries WHERE target_lang = ?)",
+                (self.target_lang,),
+            )
+            self.conn.execute("DELETE FROM tm_entries WHERE target_lang = ?", (self.target_lang,))
+            cursor = self.conn.execute(
+                "SELECT source, translation FROM translations WHERE target_lang = ?", (self.target_lang,)
+            )
+            while rows := cursor.fetchmany(10000):
+                self._write_tm(rows)
+                count += len(rows)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tm_state (target_lang, version) VALUES (?, ?)",
+                (self.target_lang, TM_INDEX_VERSION),
+            )
+            self._tm_indexed = True
+        print(f"🧠 翻译记忆索引: 已为 {count:,} 条缓存建立持久化索引 "
+              f"(构建耗时 {time.perf_counter() - start:.2f} 秒，之后的运行直接使用)")
 
-        usage_info = f"   已使用字符数: {used:,} / 限制: {limit:,} ({percentage*100:.2f}%)."
-        
-        if percentage > quota_threshold:
-            print(f"\n🔴 DeepL API 配额即将耗尽！")
-            print(usage_info)
-            print(f"   {reset_output}")
-            print("程序已退出。")
-            sys.exit(1)
-        elif percentage > quota_threshold - 0.15: 
-            print(f"\n⚠️ DeepL API 配额使用警告！")
-            print(usage_info)
-            print(f"   {reset_output}")
-        else:
-             print(f"\n🟢 DeepL API 配额检查通过。")
-             print(usage_info)
-             print(f"   {reset_output}")
-
-    except requests.exceptions.RequestException as e:
-        # 捕获所有在初始化 API 或检查用量时发生的网络/HTTP 错误
-        print(f"\n🔴 启动失败：无法连接 DeepL API 或服务器返回错误。")
-        print(f"   详细错误: {e}")
-        print("请检查您的网络连接、DeepL API Key 是否有效，以及 API 端点是否正确。")
-        sys.exit(1)
-    except EnvironmentError as e:
-        print(f"🔴 DeepL 配置错误: {e}")
-        sys.exit(1)
-        
-    # 3. 查找文件并处理
-    cache = TranslationCache()
-    srt_files = [f for f in Path.cwd().glob("*.srt") if not f.name.endswith(".zh.srt")]
+    def translation_memory(self, threshold: float) -> "SqliteTranslationMemory":
+        self.flush()
+        if not self._tm_indexed:
+            self._build_tm()
+        return SqliteTranslationMemory(threshold, self)
 
-    if not srt_files:
-        print("\n⚠️ 在当前目录下未找到待翻译的 SRT 文件 (*.srt，跳过 *.zh.srt)。")
-        print("请将 SRT 文件放入程序所在目录后重试。")
-        return
+    def tm_exact(self, normalized: str) -> int | None:
+        entry = self.tm_entry_id(normalized)
+        with self._lock:
+            row = self.conn.execute("SELECT normalized FROM tm_entries WHERE id = ?", (entry,)).fetchone()
+        return entry if row is not None and row[0] == normalized else None
 
-    print(f"找到 {len(srt_files)} 个 SRT 文件，开始翻译...")
-    
-    for file in srt_files:
-        process_srt_file(file, api, cache, settings)
+    def tm_candidates(self, band_keys: List[int]) -> List[Tuple[int, str]]:
+        placeholders = ", ".join("?" * len(band_keys))
+        with self._lock:
+            return self.conn.execute(
+                "SELECT DISTINCT e.id, e.normalized FROM tm_bands b JOIN tm_entries e ON e.id = b.entry "
+                f"WHERE b.band_key IN ({placeholders}) AND e.target_lang = ?",
+                (*band_keys, self.target_lang),
+            ).fetchall()
+
+    def tm_translation(self, entry: int) -> str | None:
+        with self._lock:
+            row = self.conn.execute("SELECT translation FROM tm_entries WHERE id = ?", (entry,)).fetchone()
+        return row[0] if row else None
+
+    def tm_count(self) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM tm_entries WHERE target_lang = ?", (self.target_lang,)
+            ).fetchone()[0]
+
+def json_cache_files(target_lang: str = "ZH", translator: str = "deepl") -> Tuple[Path, Path]:
+    """JSON 缓存的 (快照, 日志) 文件：ZH + DeepL 沿用 cache.json / cache.journal，
+    其他目标语言与离线后端加上后缀，如 cache.de.json、cache.dictionary.json、cache.de.dictionary.json"""
+    scope = [target_lang.lower()] if target_lang.upper() != "ZH" else []
+    if translator != 'deepl':
+        scope.append(translator)
+    if not scope:
+        return CACHE_FILE, CACHE_JOURNAL_FILE
+    suffix = "." + ".".join(scope)
+    return CACHE_FILE.with_suffix(f"{suffix}.json"), CACHE_JOURNAL_FILE.with_suffix(f"{suffix}.journal")
+
+def create_cache_backend(settings: dict) -> CacheBackend:
+    """根据配置 cache_backend (json / sqlite) 创建缓存后端。
+
+    缓存按目标语言与翻译后端隔离：JSON 缓存的文件名见 json_cache_files，
+    SQLite 中以目标语言 (离线后端为 "<目标语言>@<后端>") 为语言键，不同语言、不同后端的译文互不可见。
+    """
+    backend = settings.get('cache_backend', 'json')
+    translator = settings.get('backend', 'deepl')
+    target_lang = settings.get('target_lang', 'ZH')
+    if backend == 'sqlite':
+        return SqliteCacheBackend(
+            db_file=Path(settings.get('cache_db', CACHE_DB_FILE)),
+            target_lang=target_lang if translator == 'deepl' else f"{target_lang}@{translator}",
+            flush_every=settings.get('cache_flush_every', 50),
+        )
+    if backend == 'json':
+        cache_file, journal_file = json_cache_files(target_lang, translator)
+        return JsonCacheBackend(
+            cache_file=cache_file,
+            journal_file=journal_file,
+            flush_every=settings.get('cache_flush_every', 50),
+            compact_bytes=int(settings.get('cache_compact_mb', 8) * 1024 * 1024),
+        )
+    raise EnvironmentError(f"未知的缓存后端: {backend}（可选 json / sqlite）")
+
+def migrate_json_cache(json_file: Path, backend: CacheBackend) -> int:
+    """一次性将 cache.json（及未合并的 cache.journal）导入到指定后端，返回导入条目数。"""
+    source = JsonCacheBackend(cache_file=json_file, journal_file=json_file.with_suffix(".journal"))
+    backend.set_many(source.cache.items())
+    backend.flush()
+    return len(source.cache)
+
+class TranslationCache:
+    """翻译缓存管理类（委托给可插拔的存储后端）
+
+    首次需要近似匹配时取得翻译记忆：后端支持持久化索引 (SQLite) 时直接使用，由后端在写入时维护；
+    否则由缓存全部条目在内存中构建，之后的新译文同步加入，同一进程内只构建一次。
+    """
+    def __init__(self, backend: CacheBackend | None = None):
+        self.backend = backend if backend is not None else JsonCacheBackend()
+        self._memory: "TranslationMemory | None" = None
+
+    def get(self, text: str) -> str | None:
+        return self.backend.get(text)
+
+    def set(self, text: str, translation: str):
+        self.backend.set(text, translation)
+        if self._memory is not None and not self._memory.persistent:
+            self._memory.add(text, translation)
+
+    def memory(self, threshold: float) -> "TranslationMemory":
+        if self._memory is None or self._memory.threshold != threshold:
+            memory = self.backend.translation_memory(threshold)
+            if memory is None:
+                start = time.perf_counter()
+                memory = TranslationMemory.from_cache(self, threshold)
+                print(f"🧠 翻译记忆索引: {len(memory):,} 条 (构建耗时 {time.perf_counter() - start:.2f} 秒)")
+            self._memory = memory
+        return self._memory
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        return self.backend.items()
+
+    def flush(self):
+        with PROFILER.stage("cache_flush"):
+            self.backend.flush()
+
+    def close(self):
+        with PROFILER.stage("cache_flush"):
+            self.backend.close()
+
+# --- 翻译记忆 ---
+
+class TranslationMemory:
+    """翻译记忆：规范化精确匹配 + MinHash/LSH 近似匹配
+
+    规范化忽略大小写、空白、引号写法以及句末的句号/省略号 ("I don't know." 与 "i don't know...")。
+    近似匹配以字符 3-gram 集合的 Jaccard 相似度衡量：每条原文用单次哈希的 MinHash (one permutation
+    hashing，n-gram 哈希按取模分到 TM_BANDS × TM_ROWS 个槽并各取最小值) 计算签名，按段 (LSH banding)
+    放入倒排桶；查询只验证同桶的少量候选。
+    本类把索引保存在内存中；存储由 _exact / _candidates / translation 提供，SqliteTranslationMemory
+    改为查询缓存数据库中的持久化索引。translation 为 None 的条目表示尚未翻译的文本。
+    """
+    # 索引是否由缓存后端持久化并维护 (为 False 时由 TranslationCache 同步加入新译文)
+    persistent = False
+
+    def __init__(self, threshold: float, bands: int = TM_BANDS, rows: int = TM_ROWS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.exact: Dict[str, int] = {}
+        self.sources: List[str] = []
+        self.translations: List[str | None] = []
+        # 桶内只有一个条目时直接保存编号，出现碰撞时才换成列表，节省内存
+        self.buckets: Dict[int, int | List[int]] = {}
+
+    @classmethod
+    def from_cache(cls, cache: "TranslationCache", threshold: float) -> "TranslationMemory":
+        memory = cls(threshold)
+        for text, translation in cache.items():
+            memory.add(text, translation)
+        return memory
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = " ".join(text.casefold().translate(TM_QUOTE_TABLE).split())
+        return TM_TRAILING_PATTERN.sub("", text) or text
+
+    @staticmethod
+    def shingles(normalized: str) -> set:
+        padded = f" {normalized} "
+        return {padded[i:i + TM_NGRAM] for i in range(len(padded) - TM_NGRAM + 1)}
+
+    @staticmethod
+    def indexable(normalized: str) -> bool:
+        return len(normalized) >= TM_MIN_CHARS
+
+    def _fuzzy(self, normalized: str) -> bool:
+        return self.threshold < 1 and self.indexable(normalized)
+
+    @staticmethod
+    def band_keys(normalized: str, bands: int = TM_BANDS, rows: int = TM_ROWS) -> List[int]:
+        """MinHash 签名按段组合成桶键。n-gram 用 CRC32 而非 hash() 哈希，跨进程稳定，可以持久化；
+        桶键不超过 63 位 (SQLite INTEGER)。"""
+        padded = f" {normalized} "
+        slots = bands * rows
+        signature = [MASK64] * slots
+        crc32 = zlib.crc32
+        for i in range(len(padded) - TM_NGRAM + 1):
+            value, slot = divmod(crc32(padded[i:i + TM_NGRAM].encode("utf-8")), slots)
+            if value < signature[slot]:
+                signature[slot] = value
+        keys = []
+        for band in range(bands):
+            key = band
+            for value in signature[band * rows:(band + 1) * rows]:
+                key = (key * TM_BAND_MULTIPLIER + value) & MASK63
+            keys.append(key)
+        return keys
+
+    def translation(self, entry: int) -> str | None:
+        return self.translations[entry]
+
+    def _exact(self, normalized: str) -> int | None:
+        return self.exact.get(normalized)
+
+    def _candidates(self, band_keys: List[int]) -> Iterable[Tuple[int, str]]:
+        candidates = set()
+        for key in band_keys:
+            bucket = self.buckets.get(key)
+            if isinstance(bucket, list):
+                candidates.update(bucket)
+            elif bucket is not None:
+                candidates.add(bucket)
+        return ((candidate, self.sources[candidate]) for candidate in candidates)
+
+    def add(self, text: str, translation: str | None) -> int:
+        """加入一条原文及译文，返回条目编号 (规范化后已存在时更新译文并返回已有条目)"""
+        normalized = self.normalize(text)
+        entry = self.exact.get(normalized)
+        if entry is not None:
+            if translation is not None:
+                self.translations[entry] = translation
+            return entry
+        entry = len(self.sources)
+        self.exact[normalized] = entry
+        self.sources.append(normalized)
+        self.translations.append(translation)
+        if self._fuzzy(normalized):
+            for key in self.band_keys(normalized, self.bands, self.rows):
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    self.buckets[key] = entry
+                elif isinstance(bucket, list):
+                    bucket.append(entry)
+                else:
+                    self.buckets[key] = [bucket, entry]
+        return entry
+
+    def lookup(self, text: str) -> Tuple[int, float] | None:
+        """查找最相似的条目，返回 (条目编号, 相似度)；规范化后完全相同时相似度为 1.0"""
+        normalized = self.normalize(text)
+        entry = self._exact(normalized)
+        if entry is not None:
+            return entry, 1.0
+        if not self._fuzzy(normalized):
+            return None
+
+        grams = self.shingles(normalized)
+        best = None
+        for candidate, source in self._candidates(self.band_keys(normalized, self.bands, self.rows)):
+            other = self.shingles(source)
+            similarity = len(grams & other) / len(grams | other)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+class SqliteTranslationMemory(TranslationMemory):
+    """保存在 SQLite 缓存数据库中的翻译记忆 (索引由 SqliteCacheBackend 在写入缓存时维护)
+
+    启动时无需重建，精确匹配走主键、近似匹配走桶键索引，内存占用与记忆库规模无关。
+    """
+    persistent = True
+
+    def __init__(self, threshold: float, backend: SqliteCacheBackend):
+        super().__init__(threshold)
+        self.backend = backend
+
+    def __len__(self) -> int:
+        return self.backend.tm_count()
+
+    def translation(self, entry: int) -> str | None:
+        return self.backend.tm_translation(entry)
+
+    def _exact(self, normalized: str) -> int | None:
+        return self.backend.tm_exact(normalized)
+
+    def _candidates(self, band_keys: List[int]) -> Iterable[Tuple[int, str]]:
+        return self.backend.tm_candidates(band_keys)
+
+    def add(self, text: str, translation: str | None) -> int:
+        """写入缓存 (索引随缓存提交一起更新)；持久化记忆不保存未翻译的文本"""
+        if translation is None:
+            raise ValueError("持久化翻译记忆不能保存未翻译的文本")
+        self.backend.set(text, translation)
+        return self.backend.tm_entry_id(self.normalize(text))
+
+    def lookup(self, text: str) -> Tuple[int, float] | None:
+        # 先提交尚在缓冲区中的译文，使其可被匹配
+        self.backend.flush()
+        return super().lookup(text)
+
+# --- SRT 文件处理 ---
+
+def translate_batches(api: Translator, batches: List[List[str]], concurrency: int = 1,
+                      on_result: Callable[[int, List[str]], None] | None = None,
+                      budget: CharacterBudget | None = None
+                      ) -> Tuple[List[List[str]], List[int], bool]:
+    """翻译所有批次，返回 (与 batches 顺序一致的译文列表, 每批请求尝试次数, 是否配额耗尽)。
+
+    concurrency > 1 时通过有界线程池并发发送，请求速率由 api 的令牌桶统一限制。
+    配额耗尽 (或超出字符预算 budget) 后不再发送新的批次，未完成批次的译文为空。
+    单个批次的其他异常只使该批次失败 (译文为空)，不影响其余批次。
+    on_result(batch_idx, 译文) 在每个批次完成后于调用线程中执行，用于及时持久化结果。
+    """
+    total = len(batches)
+    results: List[List[str]] = [[""] * len(batch) for batch in batches]
+    batch_stats = [{'attempts': 0} for _ in batches]
+    quota_exceeded = False
+    PROFILER.gauge("queue_depth", total, queue="batches")
+
+    def run_batch(batch_idx: int) -> List[str]:
+        batch = batches[batch_idx]
+        if budget is not None and not budget.consume(sum(len(text) for text in batch)):
+            raise QuotaExceededError(f"批次 {batch_idx + 1} 超出本次运行的字符预算，停止发送。")
+        return api.translate_many(batch, batch_stats[batch_idx])
+
+    if concurrency <= 1 or total <= 1:
+        for batch_idx, batch in enumerate(batches):
+            sys.stdout.write(f"\r⚙️ 正在翻译批次 {batch_idx + 1}/{total}...")
+            sys.stdout.flush()
+            try:
+                results[batch_idx] = run_batch(batch_idx)
+                if on_result:
+                    on_result(batch_idx, results[batch_idx])
+            except QuotaExceededError as e:
+                print(f"\n🔴 {e}")
+                quota_exceeded = True
+                break
+            except AuthError:
+                raise
+            except Exception as e:
+                print(f"\n❌ 批次 {batch_idx + 1} 处理出错: {e!r}")
+            PROFILER.gauge("queue_depth", total - batch_idx - 1, queue="batches")
+        return results, [stats['attempts'] for stats in batch_stats], quota_exceeded
+
+    done = 0
+    with concurrent_futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(run_batch, batch_idx): batch_idx for batch_idx in range(total)}
+        for future in concurrent_futures.as_completed(futures):
+            batch_idx = futures[future]
+            try:
+                results[batch_idx] = future.result()
+                if on_result:
+                    on_result(batch_idx, results[batch_idx])
+            except QuotaExceededError as e:
+                if not quota_exceeded:
+                    print(f"\n🔴 {e}")
+                    quota_exceeded = True
+                    for pending in futures:
+                        pending.cancel()
+                continue
+            except AuthError:
+                # Key 被拒绝时其余批次同样会失败：不再发送，交给调用方处理
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as e:
+                print(f"\n❌ 批次 {batch_idx + 1} 处理出错: {e!r}")
+            done += 1
+            PROFILER.gauge("queue_depth", total - done, queue="batches")
+            sys.stdout.write(f"\r⚙️ 正在翻译批次 {done}/{total} (并发 {concurrency})...")
+            sys.stdout.flush()
+    return results, [stats['attempts'] for stats in batch_stats], quota_exceeded
+
+def report_retries(batch_attempts: List[int]):
+    """打印每个批次的请求尝试次数 (仅在发生重试时)"""
+    retried = [(idx, attempts) for idx, attempts in enumerate(batch_attempts) if attempts > 1]
+    if not retried:
+        return
+    details = ", ".join(f"批次 {idx + 1}: {attempts} 次" for idx, attempts in retried)
+    print(f"\n🔁 重试统计: 共 {sum(batch_attempts)} 次请求尝试；发生重试的批次 — {details}")
+
+def find_srt_files(paths: List[Path], recursive: bool = False,
+                   include: List[str] | None = None, exclude: List[str] | None = None,
+                   target_lang: str = "ZH") -> List[Path]:
+    """在给定路径中查找待翻译的 SRT 文件 (始终跳过 *.zh.srt 与当前目标语言的输出 *.<目标语言>.srt)。
+
+    include / exclude 为 glob 模式，同时匹配文件名和相对于所在输入目录的路径。
+    直接指定的文件不受 include 过滤。
+    """
+    include = include or ["*.srt"]
+    exclude = list(dict.fromkeys(["*.zh.srt", f"*{output_suffix(target_lang)}", *(exclude or [])]))
+
+    def matches(path: Path, root: Path, patterns: List[str]) -> bool:
+        rel = path.relative_to(root).as_posix()
+        return any(fnmatch(path.name, p) or fnmatch(rel, p) for p in patterns)
+
+    found = set()
+    for path in paths:
+        if path.is_file():
+            if not matches(path, path.parent, exclude):
+                found.add(path.resolve())
+            continue
+        if not path.is_dir():
+            print(f"⚠️ 路径不存在，已跳过: {path}")
+            continue
+        candidates = path.rglob("*") if recursive else path.glob("*")
+        for candidate in candidates:
+            if (candidate.is_file() and matches(candidate, path, include)
+                    and not matches(candidate, path, exclude)):
+                found.add(candidate.resolve())
+    return sorted(found)
+
+class Cue:
+    """一条字幕
+
+    使用 __slots__ 且只保存字符串：head 为 "序号\n时间轴" (时间轴已规范化，可直接输出)，
+    body 为以换行连接的原文行。text (去除标记后的原文，即缓存键) 与 key (规范化后的去重键)
+    在构造时计算一次，供规划、缓存查询与输出渲染复用；单行且无需清理的字幕 (绝大多数)
+    中 body、text 与 key 是同一个字符串对象。
+    """
+    __slots__ = ("head", "body", "text", "key")
+
+    def __init__(self, index: str, timing: str, body: str):
+        self.head = f"{index}\n{timing}"
+        self.body = body
+        text = body.replace("\n", " ") if "\n" in body else body
+        if "[" in text or "{" in text:
+            text = MARKUP_PATTERN.sub("", text)
+        # str.strip() 与 normalize_cache_key 在无需修改时返回原对象或相等的字符串
+        self.text = text = text.strip()
+        key = normalize_cache_key(text)
+        self.key = text if key == text else key
+
+    @property
+    def index(self) -> str:
+        return self.head.partition("\n")[0]
+
+    @property
+    def timing(self) -> str:
+        return self.head.partition("\n")[2]
+
+# 毫秒部分为 1~3 位时换算为毫秒的倍数 ("5" -> 500, "05" -> 50, "005" -> 5)
+FRACTION_SCALE = (0, 100, 10, 1)
+
+def timestamp_to_ms(hours: str, minutes: str, seconds: str, fraction: str) -> int:
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(fraction) * FRACTION_SCALE[len(fraction)]
+
+def format_timestamp(ms: int) -> str:
+    return "%02d:%02d:%02d,%03d" % (ms // 3600_000, ms // 60_000 % 60, ms // 1000 % 60, ms % 1000)
+
+def normalize_timing(line: str) -> str | None:
+    """时间轴行规范化为 "HH:MM:SS,mmm --> HH:MM:SS,mmm"；不是时间轴时返回 None。
+
+    已是标准格式的行 (绝大多数) 原样返回，不做整数换算与格式化。
+    """
+    if CANONICAL_TIMING_PATTERN.match(line):
+        return line
+    match = SRT_TIMESTAMP_PATTERN.match(line)
+    if not match:
+        return None
+    h1, m1, s1, f1, h2, m2, s2, f2 = match.groups()
+    return (f"{format_timestamp(timestamp_to_ms(h1, m1, s1, f1))} --> "
+            f"{format_timestamp(timestamp_to_ms(h2, m2, s2, f2))}")
+
+def iter_srt_cues(stream: Iterable[str]) -> Iterator[Cue]:
+    """逐行解析 SRT 文本流，每解析完一条字幕即产出一个 Cue。
+
+    容错处理：CRLF 换行、UTF-8 BOM、字幕之间缺少空行、行尾多余空白、
+    时间轴中使用 "." 作为毫秒分隔符，以及缺失的序号 (按顺序补齐)。
+    纯数字行只有在紧跟时间轴时才被视为序号，否则作为正文。
+    """
+    index = timing = None
+    lines: List[str] = []
+    held_digits = None
+    count = 0
+
+    for line_no, raw_line in enumerate(stream):
+        line = raw_line.rstrip()
+        if line_no == 0:
+            line = line.lstrip("\ufeff")
+
+        next_timing = normalize_timing(line) if "-->" in line else None
+        if next_timing is not None:
+            if index is not None:
+                yield Cue(index, timing, "\n".join(lines))
+            count += 1
+            index = held_digits if held_digits is not None else str(count)
+            held_digits = None
+            timing = next_timing
+            lines = []
+            continue
+
+        if held_digits is not None:
+            # 上一行的数字后面没有时间轴，属于正文
+            if index is not None:
+                lines.append(held_digits)
+            held_digits = None
+
+        stripped = line.strip()
+        if stripped.isdigit():
+            held_digits = stripped
+        elif stripped and index is not None:
+            lines.append(line)
+
+    if index is not None:
+        if held_digits is not None:
+            lines.append(held_digits)
+        yield Cue(index, timing, "\n".join(lines))
+
+def render_cue(cue: Cue, translated: str) -> str:
+    """生成一条双语字幕：原文行 + 一行译文"""
+    if cue.body:
+        return f"{cue.head}\n{cue.body}\n{translated}\n\n"
+    return f"{cue.head}\n{translated}\n\n"
+
+def output_suffix(target_lang: str = "ZH") -> str:
+    """双语字幕的文件后缀：.<目标语言小写>.srt (ZH 为 .zh.srt)"""
+    return f".{target_lang.lower()}.srt"
+
+def output_path_for(file_path: Path, target_lang: str = "ZH") -> Path:
+    return file_path.with_suffix(output_suffix(target_lang))
+
+def file_sha256(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with file_path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# --- 断点续传 ---
+
+class Checkpoint:
+    """单个输入文件的断点清单
+
+    <文件名>.ckpt.json 在开始翻译前写入一次，记录源文件哈希、解析出的字幕，以及该文件的待翻译文本
+    实际被分入的批次 ({批次 ID: 本文件在该批次中的文本})。批次 ID 对应本次运行全局规划、真正发送的批次，
+    多个文件可以共用同一个批次。<文件名>.ckpt.log 为追加写入的进度日志，每完成一个批次追加一行批次 ID，
+    只写入该批次涉及的文件，不再重写清单。
+    重新运行时若源文件哈希一致，直接从清单恢复字幕 (跳过解析)，未完成的批次按记录的划分最先发送。
+    已完成批次的译文保存在翻译缓存中 (先刷新缓存，再追加进度)；进度日志丢失最后几行只会使
+    对应批次在恢复时重新排队，其中已缓存的文本不会再次发送。
+    """
+    VERSION = 3
+
+    def __init__(self, path: Path, source_hash: str, batches: Dict[str, List[str]],
+                 completed: Iterable[str] = (), cue_rows: List[list] | None = None):
+        self.path = path
+        self.log_path = path.with_suffix(".log")
+        self.source_hash = source_hash
+        self.batches = batches
+        self.completed = set(completed)
+        self.cue_rows = cue_rows or []
+
+    @staticmethod
+    def path_for(file_path: Path) -> Path:
+        return file_path.with_suffix(".ckpt.json")
+
+    @classmethod
+    def create(cls, file_path: Path, source_hash: str, cues: List[Cue],
+               batches: Dict[str, List[str]]) -> "Checkpoint":
+        cue_rows = [[cue.index, cue.timing, cue.body] for cue in cues]
+        checkpoint = cls(cls.path_for(file_path), source_hash, batches, cue_rows=cue_rows)
+        # 旧的进度日志属于另一份清单
+        checkpoint.log_path.unlink(missing_ok=True)
+        return checkpoint
+
+    @classmethod
+    def load(cls, file_path: Path, source_hash: str) -> "Checkpoint | None":
+        """读取清单与进度日志；不存在、已损坏或源文件已变化时返回 None"""
+        path = cls.path_for(file_path)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if data.get("version") != cls.VERSION or data.get("source_hash") != source_hash:
+            return None
+        checkpoint = cls(path, source_hash, data["batches"], cue_rows=data["cues"])
+        try:
+            with checkpoint.log_path.open("r", encoding="utf-8") as f:
+                # 最后一行可能因崩溃而不完整，不属于清单中的批次，直接忽略
+                checkpoint.completed = {line.strip() for line in f} & checkpoint.batches.keys()
+        except OSError:
+            pass
+        return checkpoint
+
+    def restore_cues(self) -> List[Cue]:
+        return [Cue(index, timing, body) for index, timing, body in self.cue_rows]
+
+    def pending_batches(self) -> Dict[str, List[str]]:
+        """未完成的批次 (按清单中的发送顺序)"""
+        return {batch_id: texts for batch_id, texts in self.batches.items() if batch_id not in self.completed}
+
+    def pending_texts(self) -> List[str]:
+        return [text for texts in self.pending_batches().values() for text in texts]
+
+    def mark_completed(self, translations: Dict[str, str], batch_ids: Iterable[str] | None = None) -> List[str]:
+        """把本文件文本均已有译文的批次 (只检查 batch_ids，默认全部) 追加到进度日志，返回新完成的批次 ID"""
+        done = [batch_id for batch_id in (self.batches if batch_ids is None else batch_ids)
+                if batch_id not in self.completed and all(text in translations for text in self.batches[batch_id])]
+        if done:
+            self.completed.update(done)
+            with PROFILER.stage("checkpoint_save"), self.log_path.open("a", encoding="utf-8") as f:
+                f.write("".join(f"{batch_id}\n" for batch_id in done))
+        return done
+
+    def save(self):
+        data = {
+            "version": self.VERSION,
+            "source_hash": self.source_hash,
+            "batches": self.batches,
+            "cues": self.cue_rows,
+        }
+        tmp_file = self.path.with_suffix(".json.tmp")
+        with PROFILER.stage("checkpoint_save"), tmp_file.open("w", encoding="utf-8") as f:
+            # json.dumps 使用 C 编码器，比 json.dump 的逐块编码快得多
+            f.write(json.dumps(data, ensure_ascii=False))
+        os.replace(tmp_file, self.path)
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+        self.log_path.unlink(missing_ok=True)
+
+class SrtJob:
+    """一个待翻译的 SRT 文件及其解析出的字幕"""
+    def __init__(self, file_path: Path, cues: List[Cue], source_hash: str = "",
+                 checkpoint: Checkpoint | None = None):
+        self.file_path = file_path
+        self.cues = cues
+        self.source_hash = source_hash
+        self.checkpoint = checkpoint
+        self.store_key: str | None = None
+
+def load_srt_job(file_path: Path, use_checkpoint: bool = True) -> SrtJob | None:
+    """以流式方式读取并解析 SRT 文件 (存在匹配的断点清单时直接恢复)；失败时打印错误并返回 None"""
+    try:
+        with PROFILER.stage("hash", file_path):
+            source_hash = file_sha256(file_path)
+        PROFILER.count("bytes_read", file_path.stat().st_size, file_path)
+        if use_checkpoint:
+            with PROFILER.stage("checkpoint_load", file_path):
+                checkpoint = Checkpoint.load(file_path, source_hash)
+            if checkpoint is not None:
+                print(f"\n⏩ 从断点恢复 {file_path.name}: 已完成 {len(checkpoint.completed)}/{len(checkpoint.batches)} 个批次，"
+                      f"剩余 {len(checkpoint.pending_texts())} 条文本")
+                return SrtJob(file_path, checkpoint.restore_cues(), source_hash, checkpoint)
+
+        with PROFILER.stage("encoding", file_path):
+            encoding = detect_file_encoding(file_path, source_hash)
+        with PROFILER.stage("parse", file_path), file_path.open("r", encoding=encoding, errors="replace") as f:
+            return SrtJob(file_path, list(iter_srt_cues(f)), source_hash)
+    except Exception as e:
+        print(f"\n❌ 处理 {file_path.name} 失败: {e}")
+        return None
+
+def write_srt_job(job: SrtJob, translations: Dict[str, str], target_lang: str = "ZH") -> bool:
+    """逐条写出双语字幕 (先写临时文件再原子替换)；失败时打印错误并返回 False"""
+    output_file = output_path_for(job.file_path, target_lang)
+    tmp_file = output_file.with_suffix(".srt.tmp")
+    try:
+        with PROFILER.stage("write", job.file_path), tmp_file.open("w", encoding="utf-8") as f:
+            for cue in job.cues:
+                f.write(render_cue(cue, translations.get(cue.text) or FAILED_TRANSLATION))
+        os.replace(tmp_file, output_file)
+        PROFILER.count("bytes_written", output_file.stat().st_size, job.file_path)
+        print(f"\n🎉 翻译完成! 输出文件: {output_file.name}")
+        return True
+    except Exception as e:
+        tmp_file.unlink(missing_ok=True)
+        print(f"\n❌ 处理 {job.file_path.name} 失败: {e}")
+        return False
+
+def collect_pending_texts(srt_jobs: List[SrtJob], cache: TranslationCache,
+                          translations: Dict[str, str], fuzzy_threshold: float = 0.0) -> Dict[str, List[str]]:
+    """全局去重规划：收集所有文件中未命中缓存的文本，按规范化文本分组。
+
+    命中缓存的译文写入 translations。返回 {规范化文本: [原文写法, ...]}，
+    每组只需翻译一次（发送第一种写法）。同时打印去重率与节省的字符数。
+    fuzzy_threshold > 0 时再经过翻译记忆 (见 apply_translation_memory)。
+    """
+    groups: Dict[str, List[str]] = {}
+    looked_up = set()
+    pending_lines = pending_chars = 0
+
+    for job in srt_jobs:
+        hits = misses = job_pending_chars = 0
+        with PROFILER.stage("cache_lookup", job.file_path):
+            for cue in job.cues:
+                text = cue.text
+                if not text or text in translations:
+                    continue
+                if text not in looked_up:
+                    looked_up.add(text)
+                    cached_translation = cache.get(text)
+                    if cached_translation is not None:
+                        translations[text] = cached_translation
+                        hits += 1
+                        continue
+                    misses += 1
+                pending_lines += 1
+                job_pending_chars += len(text)
+                variants = groups.setdefault(cue.key, [])
+                if text not in variants:
+                    variants.append(text)
+        pending_chars += job_pending_chars
+        PROFILER.count("cache_hits", hits, job.file_path)
+        PROFILER.count("cache_misses", misses, job.file_path)
+        PROFILER.count("pending_chars", job_pending_chars, job.file_path)
+
+    if pending_lines:
+        unique_chars = sum(len(variants[0]) for variants in groups.values())
+        ratio = 1 - len(groups) / pending_lines
+        print(f"\n🔁 全局去重: 未缓存 {pending_lines:,} 行 → {len(groups):,} 条唯一文本 "
+              f"(去重率 {ratio * 100:.1f}%)，节省 {pending_chars - unique_chars:,} 字符")
+    if groups and fuzzy_threshold > 0:
+        with PROFILER.stage("translation_memory"):
+            apply_translation_memory(groups, cache, translations, fuzzy_threshold)
+    return groups
+
+def apply_translation_memory(groups: Dict[str, List[str]], cache: TranslationCache,
+                             translations: Dict[str, str], threshold: float):
+    """用翻译记忆减少待翻译文本 (原地修改 groups 与 translations)。
+
+    与缓存中已有原文足够相似的分组直接复用其译文；与本次运行中另一条待翻译文本相似的分组
+    并入该分组，只翻译一次。本次运行的待翻译文本放在单独的内存索引中，不会进入缓存的翻译记忆。
+    打印复用数量与节省的字符数。
+    """
+    memory = cache.memory(threshold)
+    pending = TranslationMemory(threshold)
+    pending_keys: Dict[int, str] = {}
+    reused = merged = saved = 0
+    for key in list(groups):
+        variants = groups[key]
+        match = memory.lookup(variants[0])
+        translation = memory.translation(match[0]) if match is not None else None
+        if translation is not None:
+            for variant in variants:
+                translations[variant] = translation
+            reused += 1
+        else:
+            match = pending.lookup(variants[0])
+            if match is None:
+                pending_keys[pending.add(variants[0], None)] = key
+                continue
+            groups[pending_keys[match[0]]].extend(variants)
+            merged += 1
+        del groups[key]
+        saved += len(variants[0])
+
+    PROFILER.count("tm_saved_chars", saved)
+    if reused or merged:
+        print(f"🧠 翻译记忆: {reused:,} 条复用已有译文，{merged:,} 条与相似的待翻译文本合并，节省 {saved:,} 字符")
+
+# --- 文件级译文存储 ---
+
+class FileTranslationStore:
+    """按内容寻址的整文件译文存储 (file_store/<哈希>.json)
+
+    键为配置指纹 (目标语言、翻译后端、词典内容、近似匹配阈值等，见 config_fingerprint)
+    + 全部字幕原文序列的 SHA-256，值为与字幕一一对应的译文列表；切换后端或改变配置后不会命中旧译文。
+    同一字幕以不同文件名重复出现 (重新发布、不同视频编码) 时，命中后直接渲染输出，
+    无需逐行查询缓存或调用 API。总大小超过 max_bytes 时按最近使用时间淘汰。
+    """
+    def __init__(self, directory: Path = FILE_STORE_DIR, max_bytes: int = 100 * 1024 * 1024,
+                 fingerprint: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                                if entry.name.endswith(".json"))
+
+    def key_for(self, cues: List[Cue]) -> str:
+        digest = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        for cue in cues:
+            digest.update(b"\n")
+            digest.update(cue.text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str, cue_count: int) -> List[str] | None:
+        path = self._path(key)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                stored = json.load(f)
+            os.utime(path)  # 记录最近使用时间，供淘汰参考
+        except (OSError, json.JSONDecodeError):
+            return None
+        return stored if isinstance(stored, list) and len(stored) == cue_count else None
+
+    def put(self, key: str, translations: List[str]):
+        path = self._path(key)
+        data = json.dumps(translations, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            tmp_file = path.with_suffix(".json.tmp")
+            tmp_file.write_bytes(data)
+            os.replace(tmp_file, path)
+            self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """删除最久未使用的条目，直到总大小回到上限以内"""
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+
+# --- 增量构建状态 ---
+
+def config_fingerprint(settings: dict) -> str:
+    """影响输出内容的配置指纹 (目标语言、翻译端点或离线后端、词典内容、近似匹配阈值、工具版本)
+
+    改变解析、解码或渲染结果的版本需提高 TOOL_VERSION，使旧输出失效。
+    """
+    relevant = {
+        'tool_version': TOOL_VERSION,
+        'target_lang': settings.get('target_lang', 'ZH'),
+        'translate_url': settings.get('translate_url', ''),
+    }
+    if settings.get('backend', 'deepl') != 'deepl':
+        relevant['backend'] = settings['backend']
+        if settings['backend'] == 'dictionary':
+            # 按内容而非路径：编辑词典后旧输出随之失效
+            dictionary_file = Path(settings.get('dictionary_file', DICTIONARY_FILE))
+            relevant['dictionary'] = file_sha256(dictionary_file) if dictionary_file.is_file() else ""
+    if settings.get('fuzzy_threshold', 0.0) > 0:
+        relevant['fuzzy_threshold'] = settings['fuzzy_threshold']
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+class BuildState:
+    """增量构建状态 (build_state.json)
+
+    类似构建系统的最新检查：记录每个输入文件的内容哈希、配置指纹以及输出文件的大小和修改时间。
+    输入大小与修改时间未变时直接判定为最新，无需重新计算哈希；只有哈希、指纹或输出
+    发生变化的文件才会被重新处理。
+    """
+    def __init__(self, path: Path = BUILD_STATE_FILE, fingerprint: str = "", target_lang: str = "ZH"):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.target_lang = target_lang
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.entries: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def is_up_to_date(self, file_path: Path) -> bool:
+        key = str(file_path.resolve())
+        entry = self.entries.get(key)
+        if not entry or entry.get("fingerprint") != self.fingerprint:
+            return False
+
+        output_file = output_path_for(file_path, self.target_lang)
+        try:
+            output_stat = output_file.stat()
+            source_stat = file_path.stat()
+        except OSError:
+            return False
+        if (output_stat.st_size, output_stat.st_mtime_ns) != (entry["output_size"], entry["output_mtime_ns"]):
+            return False
+
+        if (source_stat.st_size, source_stat.st_mtime_ns) == (entry["size"], entry["mtime_ns"]):
+            return True
+        if source_stat.st_size != entry["size"] or file_sha256(file_path) != entry["source_hash"]:
+            return False
+        # 内容未变，仅修改时间变化 (如被 touch 或复制)：更新记录
+        with self._lock:
+            entry["mtime_ns"] = source_stat.st_mtime_ns
+            self._dirty = True
+        return True
+
+    def record(self, file_path: Path, source_hash: str):
+        """记录一个已成功生成完整输出的文件"""
+        source_stat = file_path.stat()
+        output_stat = output_path_for(file_path, self.target_lang).stat()
+        with self._lock:
+            self.entries[str(file_path.resolve())] = {
+                "source_hash": source_hash,
+                "size": source_stat.st_size,
+                "mtime_ns": source_stat.st_mtime_ns,
+                "fingerprint": self.fingerprint,
+                "output_size": output_stat.st_size,
+                "output_mtime_ns": output_stat.st_mtime_ns,
+            }
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_file = self.path.with_suffix(".json.tmp")
+            with PROFILER.stage("build_state"), tmp_file.open("w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.path)
+            self._dirty = False
+
+# --- 配额调度 ---
+
+def schedule_jobs(srt_jobs: List[SrtJob], groups: Dict[str, List[str]], budget: int | None,
+                  strategy: str = "shortest", priority: List[str] | None = None
+                  ) -> Tuple[List[Tuple[SrtJob, int]], List[Tuple[SrtJob, int]]]:
+    """在发送前按字符预算安排文件，返回 ([(计划翻译的文件, 计费字符)], [(推迟的文件, 计费字符)])。
+
+    strategy: shortest 按待翻译字符数从少到多；priority 先按 priority 中首个匹配的 glob 排序，
+    再按字符数；order 保持输入顺序。多个文件共享的文本只计入第一个被安排的文件。
+    budget 为 None 时不限制。
+    """
+    def own_keys(job: SrtJob) -> List[str]:
+        return list(dict.fromkeys(cue.key for cue in job.cues if cue.key in groups))
+
+    def cost(keys: Iterable[str]) -> int:
+        return sum(len(groups[key][0]) for key in keys)
+
+    job_keys = {id(job): own_keys(job) for job in srt_jobs}
+    ordered = list(srt_jobs)
+    if strategy in ("shortest", "priority"):
+        ordered.sort(key=lambda job: cost(job_keys[id(job)]))
+    if strategy == "priority" and priority:
+        def rank(job: SrtJob) -> int:
+            for i, pattern in enumerate(priority):
+                if fnmatch(job.file_path.name, pattern) or fnmatch(job.file_path.as_posix(), pattern):
+                    return i
+            return len(priority)
+        ordered.sort(key=rank)
+
+    scheduled, deferred = [], []
+    covered = set()
+    spent = 0
+    for job in ordered:
+        new_keys = [key for key in job_keys[id(job)] if key not in covered]
+        job_cost = cost(new_keys)
+        if budget is None or spent + job_cost <= budget:
+            scheduled.append((job, job_cost))
+            covered.update(new_keys)
+            spent += job_cost
+        else:
+            deferred.append((job, job_cost))
+    return scheduled, deferred
+
+def print_schedule(scheduled: List[Tuple[SrtJob, int]], deferred: List[Tuple[SrtJob, int]],
+                   batches: List[List[str]], budget: int | None):
+    """打印 dry-run 计划：每个文件的计费字符、批次数与预算"""
+    print("\n🧾 翻译计划 (dry-run，不会发送任何翻译请求):")
+    for job, job_cost in scheduled:
+        print(f"   ✅ {job.file_path.name}: {len(job.cues):,} 条字幕，计费 {job_cost:,} 字符")
+    for job, job_cost in deferred:
+        print(f"   ⏸️ {job.file_path.name}: {len(job.cues):,} 条字幕，计费 {job_cost:,} 字符 (超出预算，推迟)")
+    total = sum(job_cost for _, job_cost in scheduled)
+    print(f"   合计: {len(scheduled)} 个文件，{len(batches)} 个批次，计费 {total:,} 字符")
+    if budget is not None:
+        print(f"   剩余配额预算: {budget:,} 字符，运行后剩余 {budget - total:,} 字符")
+
+def plan_resumable_batches(api: Translator, srt_jobs: List[SrtJob], groups: Dict[str, List[str]],
+                           id_prefix: str) -> Tuple[List[str], List[List[str]]]:
+    """规划待发送的批次，返回 (批次 ID 列表, 批次列表)。
+
+    断点清单中未完成的批次按记录的划分与顺序排在最前 (多个文件共用的批次合并回一个，
+    只保留仍待翻译的文本；超出当前后端请求上限时再拆分)，其余待翻译文本重新规划，
+    批次 ID 为 "<id_prefix>-<序号>"。
+    """
+    if not groups:
+        return [], []
+    representative = {variant: variants[0] for variants in groups.values() for variant in variants}
+    remaining = dict.fromkeys(variants[0] for variants in groups.values())
+    resumed: Dict[str, List[str]] = {}
+    for job in srt_jobs:
+        if job.checkpoint is None:
+            continue
+        for batch_id, texts in job.checkpoint.pending_batches().items():
+            for text in texts:
+                rep_text = representative.get(text)
+                if rep_text in remaining:
+                    del remaining[rep_text]
+                    resumed.setdefault(batch_id, []).append(rep_text)
+
+    batch_ids: List[str] = []
+    batches: List[List[str]] = []
+    for batch_id, texts in resumed.items():
+        for part_no, part in enumerate(api.plan_batches(texts)):
+            batch_ids.append(batch_id if part_no == 0 else f"{batch_id}.{part_no}")
+            batches.append(part)
+    planned = api.plan_batches(list(remaining))
+    batch_ids.extend(f"{id_prefix}-{batch_no}" for batch_no in range(len(planned)))
+    batches.extend(planned)
+    return batch_ids, batches
+
+def batch_index_of(batches: List[List[str]], groups: Dict[str, List[str]]) -> Dict[str, int]:
+    """{原文写法: 所在批次的序号}"""
+    return {variant: batch_idx for batch_idx, batch in enumerate(batches)
+            for text in batch for variant in groups[normalize_cache_key(text)]}
+
+def create_checkpoint(job: SrtJob, translations: Dict[str, str], batch_ids: List[str],
+                      batch_index: Dict[str, int]):
+    """为有待翻译文本的新文件写入断点清单：字幕 + 该文件的文本所在的批次 ID"""
+    if job.checkpoint is not None:
+        return
+    layout: Dict[int, List[str]] = {}
+    for text in dict.fromkeys(cue.text for cue in job.cues if cue.text and cue.text not in translations):
+        batch_idx = batch_index.get(text)
+        if batch_idx is not None:
+            layout.setdefault(batch_idx, []).append(text)
+    if layout:
+        # 按发送顺序记录，恢复时第一个未完成的批次最先发送
+        batches = {batch_ids[batch_idx]: layout[batch_idx] for batch_idx in sorted(layout)}
+        job.checkpoint = Checkpoint.create(job.file_path, job.source_hash, job.cues, batches)
+        job.checkpoint.save()
+
+def run_id() -> str:
+    """本次运行的批次 ID 前缀 (毫秒时间戳)，区分不同运行规划的批次"""
+    return f"{time.time_ns() // 1_000_000:x}"
+
+def merge_translations(batch: List[str], translated_texts: List[str], groups: Dict[str, List[str]],
+                       translations: Dict[str, str], cache: TranslationCache) -> bool:
+    """将一个批次的译文写入 translations 与缓存；整批为空时返回 False
+
+    同一分组的所有写法共用一次翻译结果，但只有与发送文本的规范化形式相同 (仅空白不同) 的写法写入缓存；
+    翻译记忆并入的近似写法只用于本次运行，否则近似译文会变成之后的精确命中，并继续参与近似匹配。
+    """
+    if not any(t.strip() for t in translated_texts):
+        return False
+    for original_text, translated in zip(batch, translated_texts):
+        if translated.strip():
+            translation = translated.strip()
+            key = normalize_cache_key(original_text)
+            for variant in groups[key]:
+                translations[variant] = translation
+                if variant == original_text or normalize_cache_key(variant) == key:
+                    cache.set(variant, translation)
+    return True
+
+def lookup_file_store(job: SrtJob, file_store: FileTranslationStore) -> Dict[str, str] | None:
+    """查询整文件译文存储；命中时设置 job.store_key 并返回 {原文: 译文}"""
+    key = file_store.key_for(job.cues)
+    with PROFILER.stage("file_store", job.file_path):
+        stored = file_store.get(key, len(job.cues))
+    if stored is None:
+        return None
+    job.store_key = key
+    print(f"\n📁 整文件命中: {job.file_path.name}")
+    return {cue.text: translated for cue, translated in zip(job.cues, stored) if translated}
+
+def finish_srt_job(job: SrtJob, translations: Dict[str, str], build_state: BuildState | None = None,
+                   file_store: FileTranslationStore | None = None, target_lang: str = "ZH"):
+    """写出一个文件；全部字幕都有译文时删除断点清单、记录构建状态并存入整文件译文存储"""
+    if not write_srt_job(job, translations, target_lang):
+        return
+    if all(not cue.text or cue.text in translations for cue in job.cues):
+        try:
+            if job.checkpoint is not None:
+                job.checkpoint.remove()
+            if build_state is not None:
+                build_state.record(job.file_path, job.source_hash)
+            if file_store is not None and job.store_key is None:
+                with PROFILER.stage("file_store", job.file_path):
+                    file_store.put(file_store.key_for(job.cues),
+                                   [translations.get(cue.text, "") for cue in job.cues])
+        except Exception as e:
+            print(f"\n⚠️ {job.file_path.name} 已写出，但记录完成状态失败: {e!r}")
+
+def process_srt_files(files: List[Path], api: Translator, cache: TranslationCache, settings: dict,
+                      build_state: BuildState | None = None, file_store: FileTranslationStore | None = None,
+                      char_budget: int | Callable[[], int | None] | None = None, dry_run: bool = False):
+    """批量处理多个 SRT 文件
+
+    1. 并行读取解析所有文件，整文件译文存储命中的文件直接输出；
+    2. 全局批次规划：所有文件中未命中缓存的行按规范化文本去重，每条只翻译一次，
+       并打包成满额请求 (小文件不再各发一个近乎空的请求)；
+    3. 配额调度：按 char_budget 预先计算计费字符并安排文件，超出预算的文件推迟；
+       dry_run 时只打印计划；全部命中缓存时不使用 api (延迟创建的后端不会被创建)；
+    4. 共享 API 会话与限速器翻译所有批次；
+    5. 并行写出各文件的双语字幕。
+    """
+    jobs = max(1, settings.get('file_jobs', 1))
+    use_checkpoints = settings.get('checkpoints', True)
+    with concurrent_futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        loaded = pool.map(lambda path: load_srt_job(path, use_checkpoints), files)
+        srt_jobs = [job for job in loaded if job is not None]
+
+    def finish_job(job: SrtJob, job_translations: Dict[str, str]):
+        finish_srt_job(job, job_translations, build_state, file_store, settings.get('target_lang', 'ZH'))
+
+    if file_store is not None:
+        # 整文件命中：直接按存储的译文渲染，不参与后续的缓存查询与批次规划
+        for job in srt_jobs:
+            stored = lookup_file_store(job, file_store)
+            if stored is not None and not dry_run:
+                finish_job(job, stored)
+        srt_jobs = [job for job in srt_jobs if job.store_key is None]
+        if not srt_jobs:
+            if build_state is not None and not dry_run:
+                build_state.save()
+            return
+
+    translations: Dict[str, str] = {}
+    # 从断点恢复的文件排在前面，其未完成批次最先发送
+    resumed_first = sorted(srt_jobs, key=lambda job: job.checkpoint is None)
+    groups = collect_pending_texts(resumed_first, cache, translations, settings.get('fuzzy_threshold', 0.0))
+
+    char_budget = resolve_char_budget(char_budget) if groups else None
+    scheduled, deferred = schedule_jobs(resumed_first, groups, char_budget,
+                                        settings.get('quota_strategy', 'shortest'), settings.get('priority'))
+    if deferred:
+        srt_jobs = [job for job, _ in scheduled]
+        scheduled_keys = {cue.key for job in srt_jobs for cue in job.cues}
+        # 翻译记忆合并的分组中含有其他去重键的写法，任一写法属于计划内文件即保留
+        groups = {key: variants for key, variants in groups.items()
+                  if any(normalize_cache_key(variant) in scheduled_keys for variant in variants)}
+    pending_texts = [variants[0] for variants in groups.values()]
+
+    if dry_run:
+        print_schedule(scheduled, deferred, api.plan_batches(pending_texts) if pending_texts else [], char_budget)
+        return
+
+    if deferred:
+        names = ", ".join(job.file_path.name for job, _ in deferred)
+        print(f"\n⏸️ 配额预算不足，以下 {len(deferred)} 个文件推迟到下次运行: {names}")
+
+    batch_ids, batches = plan_resumable_batches(api, srt_jobs, groups, run_id())
+    print(f"📦 {len(srt_jobs)} 个文件，待翻译 {len(pending_texts)} 条，翻译批次总数: {len(batches)}")
+
+    # 每个批次涉及的带断点清单的文件及其清单中的批次 ID：批次完成后只检查并追加这些文件的进度
+    batch_jobs: List[Dict[SrtJob, set]] = [{} for _ in batches]
+    if use_checkpoints:
+        batch_index = batch_index_of(batches, groups)
+        for job in srt_jobs:
+            if job.checkpoint is None:
+                create_checkpoint(job, translations, batch_ids, batch_index)
+            else:
+                # 上次中断前已写入缓存、但未记入进度日志的批次
+                job.checkpoint.mark_completed(translations)
+            if job.checkpoint is not None:
+                for checkpoint_id, texts in job.checkpoint.pending_batches().items():
+                    for text in texts:
+                        if text in batch_index:
+                            batch_jobs[batch_index[text]].setdefault(job, set()).add(checkpoint_id)
+
+    def merge_batch(batch_idx: int, translated_texts: List[str]):
+        """合并一个批次的结果：更新缓存 (刷新到磁盘) 后再追加涉及文件的断点进度"""
+        if not merge_translations(batches[batch_idx], translated_texts, groups, translations, cache):
+            print(f"\n❌ 批次 {batch_idx + 1} 翻译失败或返回空结果。")
+            return
+        cache.flush()
+        for job, checkpoint_ids in batch_jobs[batch_idx].items():
+            job.checkpoint.mark_completed(translations, checkpoint_ids)
+
+    batch_results, batch_attempts, quota_exceeded = translate_batches(
+        api, batches, settings.get('concurrency', 1), on_result=merge_batch,
+        budget=CharacterBudget(char_budget) if char_budget is not None else None
+    )
+
+    cache.flush()
+    report_retries(batch_attempts)
+
+    if quota_exceeded:
+        # 配额耗尽时只写出已全部翻译的文件，其余文件的已完成部分保留在缓存中
+        unfinished = [job for job in srt_jobs if any(cue.text and cue.text not in translations for cue in job.cues)]
+        srt_jobs = [job for job in srt_jobs if job not in unfinished]
+
+    with concurrent_futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda job: finish_job(job, translations), srt_jobs))
+    if build_state is not None:
+        build_state.save()
+
+    if quota_exceeded:
+        names = ", ".join(job.file_path.name for job in unfinished)
+        raise QuotaExceededError(f"以下文件未完成翻译，已停止在批次边界: {names}")
+
+def process_srt_file(file_path: Path, api: Translator, cache: TranslationCache, settings: dict):
+    """处理单个SRT文件，采用批量（Chunk-Based）翻译"""
+    print(f"\n🎬 正在处理文件: {file_path.name}")
+    process_srt_files([file_path], api, cache, settings)
+
+# --- asyncio 流水线 ---
+
+async def process_srt_files_async(files: List[Path], api: Translator, cache: TranslationCache, settings: dict,
+                                  build_state: BuildState | None = None,
+                                  file_store: FileTranslationStore | None = None,
+                                  char_budget: int | Callable[[], int | None] | None = None):
+    """asyncio 流水线 (--async)：解析、翻译、写出三个阶段通过有界队列衔接
+
+    解析第 N+1 个文件、翻译第 N 个文件的批次与写出第 N-1 个文件同时进行，队列满时上游阶段等待 (背压)；
+    最多 file_jobs 个文件同时处于翻译阶段。HTTP 请求与文件读写经 asyncio.to_thread 在线程中执行，
+    复用同一个会话与限速器。批次按文件单独规划；多个文件共有的文本只翻译一次 (后到的文件等待
+    先到文件的结果)。fuzzy_threshold > 0 时翻译记忆的合并结果取决于全部待翻译文本，因此先解析
+    全部文件，与同步模式相同地做一次全局去重与翻译记忆规划，各文件再翻译分配给它的分组
+    (翻译与写出仍然重叠)；两种情况下输出都与同步模式一致。
+    没有发送前的配额调度，char_budget 只在运行时限制字符数 (超出后停止在批次边界)，
+    在第一个需要发送批次的文件处才求值。
+    """
+    jobs = max(1, settings.get('file_jobs', 1))
+    concurrency = max(1, settings.get('concurrency', 1))
+    use_checkpoints = settings.get('checkpoints', True)
+    fuzzy_threshold = settings.get('fuzzy_threshold', 0.0)
+    budget: CharacterBudget | None = None
+    budget_resolved = False
+
+    parsed: asyncio.Queue = asyncio.Queue(maxsize=jobs)
+    finished: asyncio.Queue = asyncio.Queue(maxsize=jobs)
+    semaphore = asyncio.Semaphore(concurrency)
+    file_slots = asyncio.Semaphore(jobs)
+    # 规范化文本 -> 正在翻译它的文件完成时设置的 future (结果为 {规范化文本: 译文})
+    in_flight: Dict[str, asyncio.Future] = {}
+    translations: Dict[str, str] = {}
+    unfinished: List[SrtJob] = []
+    all_attempts: List[int] = []
+    run = run_id()
+    job_numbers = itertools.count()
+    quota_exceeded = False
+    # 全局规划 (仅 fuzzy_threshold > 0)：{规范化文本: [原文写法, ...]}、{原文写法: 所属分组}、
+    # {分组: 负责翻译它的文件完成时设置的 future}
+    plan: Dict[str, List[str]] | None = {} if fuzzy_threshold > 0 else None
+    plan_keys: Dict[str, str] = {}
+    owners: Dict[str, asyncio.Future] = {}
+
+    async def parse_stage():
+        if plan is None:
+            for file_path in files:
+                job = await asyncio.to_thread(load_srt_job, file_path, use_checkpoints)
+                if job is not None:
+                    await parsed.put(job)
+                    PROFILER.gauge("queue_depth", parsed.qsize(), queue="parsed")
+            await parsed.put(None)
+            return
+
+        srt_jobs = []
+        for file_path in files:
+            job = await asyncio.to_thread(load_srt_job, file_path, use_checkpoints)
+            if job is None:
+                continue
+            stored = lookup_file_store(job, file_store) if file_store is not None else None
+            if stored is not None:
+                await finished.put((job, stored))
+            else:
+                srt_jobs.append(job)
+        # 与同步模式相同：从断点恢复的文件排在前面，全部文件一起去重并经过翻译记忆
+        srt_jobs.sort(key=lambda job: job.checkpoint is None)
+        plan.update(await asyncio.to_thread(collect_pending_texts, srt_jobs, cache, translations, fuzzy_threshold))
+        plan_keys.update((variant, key) for key, variants in plan.items() for variant in variants)
+        for job in srt_jobs:
+            await parsed.put(job)
+            PROFILER.gauge("queue_depth", parsed.qsize(), queue="parsed")
+        await parsed.put(None)
+
+    async def translate_batch(job: SrtJob, batch: List[str], groups: Dict[str, List[str]]):
+        nonlocal quota_exceeded
+        stats = {'attempts': 0}
+        async with semaphore:
+            if quota_exceeded:
+                return
+            try:
+                if budget is not None and not budget.consume(sum(len(text) for text in batch)):
+                    raise QuotaExceededError(f"{job.file_path.name} 的批次超出本次运行的字符预算，停止发送。")
+                translated_texts = await asyncio.to_thread(api.translate_many, batch, stats)
+            except QuotaExceededError as e:
+                if not quota_exceeded:
+                    print(f"\n🔴 {e}")
+                    quota_exceeded = True
+                return
+            except AuthError:
+                raise
+            except Exception as e:
+                print(f"\n❌ {job.file_path.name} 的一个批次处理出错: {e!r}")
+                return
+            finally:
+                all_attempts.append(stats['attempts'])
+        try:
+            if not merge_translations(batch, translated_texts, groups, translations, cache):
+                print(f"\n❌ {job.file_path.name} 的一个批次翻译失败或返回空结果。")
+                return
+            cache.flush()
+            if job.checkpoint is not None:
+                job.checkpoint.mark_completed(translations)
+        except Exception as e:
+            print(f"\n❌ {job.file_path.name} 的一个批次处理出错: {e!r}")
+
+    async def translate_job(job: SrtJob):
+        nonlocal budget, budget_resolved
+        done = asyncio.get_running_loop().create_future()
+        if plan is None:
+            groups = collect_pending_texts([job], cache, translations, fuzzy_threshold)
+            # 正在由其他文件翻译的文本：等待其结果而不重复发送
+            waiting = {key: (in_flight[key], groups.pop(key)) for key in list(groups) if key in in_flight}
+            own_keys = {normalize_cache_key(variant) for variants in groups.values() for variant in variants}
+            planned_by = set()
+        else:
+            # 全局规划的分组由第一个含有其任一写法的文件翻译，译文直接写入共享的 translations；
+            # 其他文件只需等待该文件完成
+            keys = dict.fromkeys(plan_keys[cue.text] for cue in job.cues if cue.text in plan_keys)
+            groups = {key: plan[key] for key in keys if key not in owners}
+            planned_by = {owners[key] for key in keys if key in owners}
+            waiting, own_keys = {}, set()
+            for key in groups:
+                owners[key] = done
+        for key in own_keys:
+            in_flight[key] = done
+        try:
+            batch_ids, batches = plan_resumable_batches(api, [job], groups, f"{run}-{next(job_numbers)}")
+            if batches and not budget_resolved:
+                remaining = resolve_char_budget(char_budget)
+                budget = CharacterBudget(remaining) if remaining is not None else None
+                budget_resolved = True
+            if use_checkpoints:
+                create_checkpoint(job, translations, batch_ids, batch_index_of(batches, groups))
+            if batches:
+                print(f"⚙️ 正在翻译 {job.file_path.name}: {len(batches)} 个批次 (并发 {concurrency})...")
+            await asyncio.gather(*(translate_batch(job, batch, groups) for batch in batches))
+        finally:
+            for key in own_keys:
+                in_flight.pop(key, None)
+            # {规范化文本: (译文, 是否为该文本本身的翻译)}；翻译记忆并入的近似写法不是
+            done.set_result({normalize_cache_key(variant): (translations[variant], normalize_cache_key(variant) == key)
+                             for key, variants in groups.items() for variant in variants if variant in translations})
+
+        for future in planned_by:
+            await future
+        for key, (future, variants) in waiting.items():
+            translated, exact = (await future).get(key, (None, False))
+            if translated:
+                for variant in variants:
+                    translations[variant] = translated
+                    if exact and normalize_cache_key(variant) == key:
+                        cache.set(variant, translated)
+
+        job_translations = {cue.text: translations[cue.text] for cue in job.cues if cue.text in translations}
+        if quota_exceeded and any(cue.text and cue.text not in job_translations for cue in job.cues):
+            # 配额耗尽时只写出已全部翻译的文件，其余文件的已完成部分保留在缓存中
+            unfinished.append(job)
+        else:
+            await finished.put((job, job_translations))
+
+    async def translate_stage():
+        tasks = []
+        while (job := await parsed.get()) is not None:
+            PROFILER.gauge("queue_depth", parsed.qsize(), queue="parsed")
+            if file_store is not None and plan is None:
+                stored = lookup_file_store(job, file_store)
+                if stored is not None:
+                    await finished.put((job, stored))
+                    continue
+            # 最多 file_jobs 个文件同时处于翻译阶段
+            await file_slots.acquire()
+            task = asyncio.create_task(translate_job(job))
+            task.add_done_callback(lambda _: file_slots.release())
+            tasks.append(task)
+            PROFILER.gauge("queue_depth", sum(not running.done() for running in tasks), queue="translating")
+        await asyncio.gather(*tasks)
+        await finished.put(None)
+
+    async def write_stage():
+        while (item := await finished.get()) is not None:
+            PROFILER.gauge("queue_depth", finished.qsize(), queue="finished")
+            job, job_translations = item
+            await asyncio.to_thread(finish_srt_job, job, job_translations, build_state, file_store,
+                                    settings.get('target_lang', 'ZH'))
+
+    await asyncio.gather(parse_stage(), translate_stage(), write_stage())
+
+    cache.flush()
+    report_retries(all_attempts)
+    if build_state is not None:
+        build_state.save()
+    if unfinished:
+        names = ", ".join(job.file_path.name for job in unfinished)
+        raise QuotaExceededError(f"以下文件未完成翻译，已停止在批次边界: {names}")
+
+# --- 监视模式 ---
+
+class FileWatcher:
+    """监视目录中新出现或被修改的 SRT 文件
+
+    安装了可选依赖 inotify_simple (Linux) 时在文件系统事件发生时立即唤醒，否则每 poll_interval 秒
+    轮询一次。每次唤醒都按与一次性运行相同的规则重新查找文件，由构建状态判断哪些需要处理；
+    文件大小与修改时间连续 debounce 秒不变后才视为写入完成 (防抖，避免翻译尚在复制中的文件)。
+    """
+    def __init__(self, paths: List[Path], build_state: BuildState, recursive: bool = False,
+                 include: List[str] | None = None, exclude: List[str] | None = None,
+                 poll_interval: float = 5.0, debounce: float = 2.0):
+        self.paths = paths
+        self.build_state = build_state
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        # 文件 -> (大小, 修改时间, 该状态首次出现的时刻)
+        self.pending: Dict[Path, Tuple[int, int, float]] = {}
+        # 处理后仍未完成的文件 (如配额不足) -> 当时的 (大小, 修改时间)；文件再次变化前不重试
+        self.attempted: Dict[Path, Tuple[int, int]] = {}
+        self.inotify = self._create_inotify()
+
+    def _create_inotify(self):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            return None
+        self._watch_mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE
+        self._dir_flag = flags.ISDIR
+        inotify = INotify()
+        self._add_watches(inotify)
+        return inotify
+
+    def _add_watches(self, inotify):
+        """监视输入目录 (递归时包括所有子目录)；重复添加同一目录不会产生新的监视"""
+        for path in self.paths:
+            if path.is_dir():
+                directories = [path, *(p for p in path.rglob("*") if p.is_dir())] if self.recursive else [path]
+                for directory in directories:
+                    with contextlib.suppress(OSError):
+                        inotify.add_watch(directory, self._watch_mask)
+            elif path.is_file():
+                inotify.add_watch(path.parent, self._watch_mask)
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.inotify is not None else f"轮询 (每 {self.poll_interval:g} 秒)"
+
+    def wait(self):
+        """等待下一次检查：有文件在防抖中时最多等待 debounce 秒"""
+        timeout = min(self.poll_interval, self.debounce) if self.pending else self.poll_interval
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+        events = self.inotify.read(timeout=int(timeout * 1000))
+        if self.recursive and any(event.mask & self._dir_flag for event in events):
+            # 新建的子目录同样需要监视
+            self._add_watches(self.inotify)
+
+    def ready_files(self) -> List[Path]:
+        """返回已写入完成、需要处理的文件"""
+        now = time.monotonic()
+        candidates = set()
+        for file_path in find_srt_files(self.paths, self.recursive, self.include, self.exclude,
+                                        self.build_state.target_lang):
+            if self.build_state.is_up_to_date(file_path):
+                continue
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.attempted.get(file_path) == signature:
+                continue
+            candidates.add(file_path)
+            previous = self.pending.get(file_path)
+            if previous is None or previous[:2] != signature:
+                self.pending[file_path] = (*signature, now)
+
+        # 已删除或已被处理的文件不再等待
+        for file_path in [path for path in self.pending if path not in candidates]:
+            del self.pending[file_path]
+        ready = sorted(path for path, (_, _, since) in self.pending.items() if now - since >= self.debounce)
+        for file_path in ready:
+            del self.pending[file_path]
+        PROFILER.gauge("queue_depth", len(self.pending), queue="watch")
+        return ready
+
+    def mark_attempted(self, files: List[Path]):
+        """记录处理后仍未完成的文件，避免在文件未变化时反复重试"""
+        for file_path in files:
+            if not self.build_state.is_up_to_date(file_path):
+                with contextlib.suppress(OSError):
+                    stat = file_path.stat()
+                    self.attempted[file_path] = (stat.st_size, stat.st_mtime_ns)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+def watch_srt_files(watcher: FileWatcher, run_files: Callable[[List[Path]], None], initial: List[Path] | None = None):
+    """监视模式主循环：先处理 initial 中启动时已存在的待处理文件，然后持续处理写入完成的文件，直到 Ctrl+C
+
+    翻译后端 (HTTP 会话、限速器)、缓存与翻译记忆、构建状态和整文件译文存储在各轮之间保持加载。
+    配额不足时未完成的文件保留在缓存中，等文件再次变化或重启后重试。
+    """
+    print(f"👀 正在监视 {', '.join(str(path) for path in watcher.paths)} ({watcher.mode})，按 Ctrl+C 停止。")
+    files = initial or []
+    try:
+        while True:
+            if files:
+                print(f"\n📥 {len(files)} 个文件待翻译: {', '.join(path.name for path in files)}")
+                try:
+                    run_files(files)
+                except QuotaExceededError as e:
+                    print(f"\n🔴 DeepL API 配额已用尽: {e}")
+                    print("已完成的翻译已保存到缓存，文件再次变化或重启后重试。")
+                watcher.mark_attempted(files)
+                print("\n👀 继续监视...")
+            watcher.wait()
+            files = watcher.ready_files()
+    except KeyboardInterrupt:
+        print("\n👋 已停止监视。")
+    finally:
+        watcher.close()
+
+# --- HTTP 任务接口 ---
+
+class TranslationJob:
+    """通过 HTTP 接口提交的一个翻译任务"""
+    def __init__(self, job_id: str, name: str, data: bytes, content_hash: str):
+        self.id = job_id
+        self.name = name
+        self.data = data
+        self.content_hash = content_hash
+        self.status = "queued"
+        self.error = ""
+        self.result: str | None = None
+        self.cues = 0
+        self.submissions = 1
+        self.created = datetime.now(timezone.utc)
+        self.finished: datetime | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "cues": self.cues,
+            "submissions": self.submissions,
+            "error": self.error,
+            "created": self.created.isoformat(timespec="seconds"),
+            "finished": self.finished.isoformat(timespec="seconds") if self.finished else None,
+        }
+
+class TranslationJobServer:
+    """HTTP 任务接口：POST /jobs 提交 SRT，GET /jobs/<id> 查询状态，GET /jobs/<id>/result 取回双语 SRT
+
+    任务进入内部队列，由 serve_jobs 个工作线程处理；所有任务共享翻译后端 (会话与限速器)、缓存、
+    整文件译文存储和字符预算。内容相同的提交在排队或翻译期间合并为同一个任务，只翻译一次。
+    缓存与整文件存储的读写在锁内进行，翻译请求不持锁并发发送。
+    """
+    def __init__(self, api: Translator, cache: TranslationCache, settings: dict,
+                 file_store: FileTranslationStore | None = None):
+        self.api = api
+        self.cache = cache
+        self.settings = settings
+        self.file_store = file_store
+        self.jobs: Dict[str, TranslationJob] = {}
+        # 内容哈希 -> 排队或翻译中的任务
+        self.in_flight: Dict[str, TranslationJob] = {}
+        self.queue: "queue.Queue[TranslationJob | None]" = queue.Queue()
+        self.workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        char_budget = remaining_char_budget(api, settings['quota_threshold'])
+        self.budget = CharacterBudget(char_budget) if char_budget is not None else None
+
+    def submit(self, name: str, data: bytes) -> Tuple[TranslationJob, bool]:
+        """提交任务，返回 (任务, 是否合并到了内容相同的进行中任务)"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            job = self.in_flight.get(content_hash)
+            if job is not None:
+                job.submissions += 1
+                return job, True
+            job = TranslationJob(os.urandom(8).hex(), name, data, content_hash)
+            self.jobs[job.id] = job
+            self.in_flight[content_hash] = job
+            self._evict()
+        self.queue.put(job)
+        PROFILER.gauge("queue_depth", self.queue.qsize(), queue="jobs")
+        return job, False
+
+    def _evict(self):
+        """保留的任务超过 SERVE_MAX_JOBS 时丢弃最早完成的任务"""
+        finished = (job_id for job_id, job in self.jobs.items() if job.finished is not None)
+        for job_id in list(finished)[:max(0, len(self.jobs) - SERVE_MAX_JOBS)]:
+            del self.jobs[job_id]
+
+    def start(self):
+        for _ in range(self.settings.get('serve_jobs', 1)):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while (job := self.queue.get()) is not None:
+            PROFILER.gauge("queue_depth", self.queue.qsize(), queue="jobs")
+            job.status = "running"
+            print(f"\n🎬 开始任务 {job.id}: {job.name}")
+            try:
+                job.result = self.translate(job)
+                job.status = "done"
+            except (Exception, SystemExit) as e:
+                # SystemExit 也只使本任务失败，工作线程继续处理后续任务
+                job.error = repr(e) if isinstance(e, SystemExit) else str(e)
+                job.status = "failed"
+                print(f"\n❌ 任务 {job.id} ({job.name}) 失败: {job.error}")
+            finally:
+                job.data = b""
+                job.finished = datetime.now(timezone.utc)
+                with self._lock:
+                    self.in_flight.pop(job.content_hash, None)
+
+    def translate(self, job: TranslationJob) -> str:
+        """翻译一个任务并返回双语 SRT 文本 (与命令行模式的输出相同)"""
+        with PROFILER.stage("encoding"):
+            text = job.data.decode(detect_text_encoding(job.data, job.content_hash), errors="replace")
+        with PROFILER.stage("parse"):
+            srt_job = SrtJob(Path(job.name), list(iter_srt_cues(text.splitlines())), job.content_hash)
+        if not srt_job.cues:
+            raise ValueError("未解析到任何字幕")
+        job.cues = len(srt_job.cues)
+
+        translations = None
+        with self._cache_lock:
+            if self.file_store is not None:
+                translations = lookup_file_store(srt_job, self.file_store)
+            if translations is None:
+                translations = {}
+                groups = collect_pending_texts([srt_job], self.cache, translations,
+                                               self.settings.get('fuzzy_threshold', 0.0))
+
+        if srt_job.store_key is None:
+            batches = self.api.plan_batches([variants[0] for variants in groups.values()])
+
+            def merge_batch(batch_idx: int, translated_texts: List[str]):
+                with self._cache_lock:
+                    if not merge_translations(batches[batch_idx], translated_texts, groups, translations, self.cache):
+                        print(f"\n❌ 任务 {job.id} 的批次 {batch_idx + 1} 翻译失败或返回空结果。")
+                        return
+                    self.cache.flush()
+
+            _, _, quota_exceeded = translate_batches(self.api, batches, self.settings.get('concurrency', 1),
+                                                     on_result=merge_batch, budget=self.budget)
+            if quota_exceeded:
+                raise QuotaExceededError("配额不足，未完成翻译；已完成的部分保存在缓存中。")
+            if self.file_store is not None and all(not cue.text or cue.text in translations for cue in srt_job.cues):
+                with self._cache_lock, PROFILER.stage("file_store"):
+                    self.file_store.put(self.file_store.key_for(srt_job.cues),
+                                        [translations.get(cue.text, "") for cue in srt_job.cues])
+
+        with PROFILER.stage("write"):
+            return "".join(render_cue(cue, translations.get(cue.text) or FAILED_TRANSLATION) for cue in srt_job.cues)
+
+    def serve_forever(self, host: str, port: int):
+        """在 host:port 上提供任务接口，直到 Ctrl+C"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        jobs_server = self
+        max_bytes = int(self.settings.get('serve_max_mb', 20) * 1024 * 1024)
+
+        class JobHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: dict | None = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status: int, data: dict, headers: dict | None = None):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self._send(status, body, "application/json; charset=utf-8", headers)
+
+            def do_POST(self):
+                path, _, query = self.path.partition("?")
+                if path.rstrip("/") != "/jobs":
+                    self._send_json(404, {"error": "未知的路径"})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0:
+                    self._send_json(400, {"error": "请求体为空，请以请求体上传 SRT 文件内容"})
+                    return
+                if length > max_bytes:
+                    self._send_json(413, {"error": f"文件超过 {max_bytes:,} 字节的上限"})
+                    return
+                data = self.rfile.read(length)
+                name = Path(parse_qs(query).get("name", [""])[0]).name or "upload.srt"
+                job, coalesced = jobs_server.submit(name, data)
+                self._send_json(202, {**job.to_dict(), "coalesced": coalesced}, {"Location": f"/jobs/{job.id}"})
+
+            def do_GET(self):
+                parts = self.path.partition("?")[0].strip("/").split("/")
+                job = jobs_server.jobs.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+                if job is None or (len(parts) == 3 and parts[2] != "result"):
+                    self._send_json(404, {"error": "任务不存在"})
+                elif len(parts) == 2:
+                    self._send_json(200, job.to_dict())
+                elif job.status != "done":
+                    self._send_json(409, job.to_dict())
+                else:
+                    filename = quote(output_path_for(Path(job.name), jobs_server.settings.get('target_lang', 'ZH')).name)
+                    self._send(200, job.result.encode("utf-8"), "application/x-subrip; charset=utf-8",
+                               {"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"})
+
+        server = ThreadingHTTPServer((host, port), JobHandler)
+        server.daemon_threads = True
+        self.start()
+        print(f"🌐 任务接口: http://{host}:{server.server_address[1]}/jobs (工作线程 {len(self.workers)})，按 Ctrl+C 停止。")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n👋 已停止任务接口。")
+        finally:
+            server.server_close()
+            self.close()
+
+    def close(self):
+        """丢弃尚未开始的任务，等待进行中的任务完成"""
+        with contextlib.suppress(queue.Empty):
+            while True:
+                job = self.queue.get_nowait()
+                if job is not None:
+                    job.status, job.error = "failed", "服务已停止"
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+# --- 主函数 ---
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="SRT 字幕批量翻译工具 (DeepL)")
+    parser.add_argument("paths", nargs="*", type=Path,
+                        help="待翻译的 SRT 文件或目录 (默认当前目录)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="只处理匹配的文件 (可重复，默认 *.srt)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="跳过匹配的文件 (可重复，*.zh.srt 与当前目标语言的输出 *.<目标语言>.srt 始终跳过)")
+    parser.add_argument("-j", "--jobs", type=int, metavar="N",
+                        help="并行读取/写出的文件数 (覆盖 config.ini 中的 file_jobs)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="使用 asyncio 流水线：解析、翻译与写出多个文件的阶段重叠进行")
+    parser.add_argument("--watch", action="store_true",
+                        help="持续监视输入目录，翻译新出现或被修改的 SRT 文件 (按 Ctrl+C 停止)")
+    parser.add_argument("--serve", nargs="?", type=int, const=0, metavar="PORT",
+                        help="启动 HTTP 任务接口 (提交 SRT、查询状态、取回双语字幕)；PORT 默认为 config.ini 中的 serve_port")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="只打印翻译计划与计费字符数，不发送翻译请求、不写出文件")
+    parser.add_argument("--priority", action="append", metavar="GLOB",
+                        help="配额不足时优先翻译匹配的文件 (可重复，按出现顺序；启用 priority 调度策略)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="忽略增量检查，重新处理所有文件")
+    parser.add_argument("--profile", action="store_true",
+                        help="运行结束时打印各阶段耗时与计数 (按运行与按文件)")
+    parser.add_argument("--profile-json", type=Path, metavar="FILE",
+                        help="将性能统计以 JSON 写入 FILE (隐含 --profile)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="在 PORT 上提供 Prometheus 指标端点 /metrics (覆盖 config.ini 中的 metrics_port)")
+    parser.add_argument("--metrics-textfile", type=Path, metavar="FILE",
+                        help="定期将 Prometheus 指标写入 FILE (node_exporter textfile 格式)")
+    parser.add_argument("--setup", action="store_true",
+                        help="检查并安装依赖库后退出 (首次使用时运行一次)")
+    parser.add_argument("--migrate-cache", nargs="?", const="", metavar="JSON",
+                        help="将 JSON 缓存 (默认为当前目标语言的 cache.json / cache.<目标语言>.json) "
+                             "一次性导入到 SQLite 缓存后端后退出")
+    args = parser.parse_args(argv)
+    if args.watch and args.dry_run:
+        parser.error("--watch 不能与 --dry-run 同时使用")
+    if args.serve is not None and (args.watch or args.dry_run):
+        parser.error("--serve 不能与 --watch / --dry-run 同时使用")
+    return args
+
+def run_cache_migration(json_file: Path, settings: dict):
+    """执行 cache.json -> SQLite 的一次性迁移"""
+    if not json_file.exists():
+        print(f"🔴 迁移失败: 未找到 {json_file}")
+        sys.exit(1)
+    backend = SqliteCacheBackend(
+        db_file=Path(settings['cache_db']),
+        target_lang=settings['target_lang'],
+        flush_every=settings['cache_flush_every'],
+    )
+    try:
+        count = migrate_json_cache(json_file, backend)
+    finally:
+        backend.close()
+    print(f"✅ 已将 {count:,} 条缓存从 {json_file} 迁移到 {settings['cache_db']}。")
+    if settings['cache_backend'] != 'sqlite':
+        print("提示: 请在 config.ini 的 [settings] 中设置 cache_backend = sqlite 以启用 SQLite 缓存。")
+
+def create_metrics_exporter(settings: dict, args: argparse.Namespace) -> MetricsExporter | None:
+    """按配置与命令行参数启动指标导出；均未启用时返回 None"""
+    port = args.metrics_port if args.metrics_port is not None else settings['metrics_port']
+    textfile = args.metrics_textfile or (Path(settings['metrics_textfile']) if settings['metrics_textfile'] else None)
+    if not port and textfile is None:
+        return None
+    exporter = MetricsExporter(PROFILER, port=port, textfile=textfile,
+                               interval=settings['metrics_interval'], host=settings['metrics_host'])
+    try:
+        exporter.start()
+    except OSError as e:
+        print(f"⚠️ 指标端点启动失败，已忽略: {e}")
+    return exporter
+
+def create_checked_translator(settings: dict) -> Translator:
+    """创建翻译后端并检查 DeepL 配额 (打印用量；超过阈值或无法连接时退出)"""
+    try:
+        api = create_translator(settings)
+        
+        used, limit, percentage, reset_date_str = api.get_usage()
+        
+        quota_threshold = settings['quota_threshold']
+        
+        if not api.billable:
+            print(f"\n🟢 使用离线翻译后端: {api.name} (不消耗 DeepL 配额)。")
+        else:
+            # --- 优化输出逻辑 ---
+        
+            if reset_date_str == "未知":
+                # 免费套餐不提供重置日期，提供清晰提示
+                reset_output = "DeepL API 免费套餐不提供确切重置日期。请登录 DeepL 账户门户查看。"
+            else:
+                reset_output = f"配额重置日期: {reset_date_str}."
+
+            usage_info = f"   已使用字符数: {used:,} / 限制: {limit:,} ({percentage*100:.2f}%)."
+            if isinstance(api, DeepLAPI) and len(api.keys) > 1:
+                active_keys = [state for state in api.keys if state.active]
+                usage_info += f"\n   可用 API Key: {len(active_keys)}/{len(api.keys)}"
+                for state in active_keys:
+                    usage_info += f"\n     🔑 {state.label}: {state.used:,} / {state.limit:,}"
+        
+            if percentage > quota_threshold:
+                print(f"\n🔴 DeepL API 配额即将耗尽！")
+                print(usage_info)
+                print(f"   {reset_output}")
+                print("程序已退出。")
+                sys.exit(1)
+            elif percentage > quota_threshold - 0.15: 
+                print(f"\n⚠️ DeepL API 配额使用警告！")
+                print(usage_info)
+                print(f"   {reset_output}")
+            else:
+                 print(f"\n🟢 DeepL API 配额检查通过。")
+                 print(usage_info)
+                 print(f"   {reset_output}")
+
+    except AuthError:
+        # 详细原因已由 DeepLAPI 打印
+        print("程序已退出。")
+        sys.exit(1)
+    except EnvironmentError as e:
+        # requests 延迟导入 (离线后端可能未安装)，其异常同为 OSError 的子类，在此区分
+        if requests is not None and isinstance(e, requests.exceptions.RequestException):
+            # 捕获所有在初始化 API 或检查用量时发生的网络/HTTP 错误
+            print(f"\n🔴 启动失败：无法连接 DeepL API 或服务器返回错误。")
+            print(f"   详细错误: {e}")
+            print("请检查您的网络连接、DeepL API Key 是否有效，以及 API 端点是否正确。")
+        else:
+            print(f"🔴 翻译后端配置错误: {e}")
+        sys.exit(1)
+    return api
+
+class DeferredTranslator:
+    """延迟创建的翻译后端：首次访问其属性或方法时才调用 factory (创建后端并检查配额)
+
+    全部文本都命中缓存的运行不会导入 requests，也不会查询 /v2/usage。其余属性与方法转发给实际的后端。
+    """
+    def __init__(self, factory: Callable[[], Translator]):
+        self._factory = factory
+        self._api: Translator | None = None
+        self._lock = threading.Lock()
+
+    def resolve(self) -> Translator:
+        if self._api is None:
+            with self._lock:
+                if self._api is None:
+                    self._api = self._factory()
+        return self._api
+
+    def __getattr__(self, name: str):
+        return getattr(self.resolve(), name)
+
+    def close(self):
+        if self._api is not None:
+            self._api.close()
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("✨ SRT 批量翻译工具 ✨")
+    if args.profile or args.profile_json:
+        PROFILER.enabled = True
+        PROFILER.reset()
+    
+    if args.setup:
+        check_and_install_dependencies()
+        return
+
+    # 1. 环境检查
+    try:
+        settings = load_config_settings(CONFIG_FILE)
+    except Exception as e:
+        print(f"🔴 启动失败: {e}")
+        sys.exit(1)
+    missing = missing_dependencies(settings)
+    if missing:
+        print(f"🔴 缺少依赖库: {', '.join(missing)}。请先运行 `{Path(sys.argv[0]).name} --setup` 安装。")
+        sys.exit(1)
+
+    if args.migrate_cache is not None:
+        json_file = Path(args.migrate_cache) if args.migrate_cache else json_cache_files(settings['target_lang'])[0]
+        run_cache_migration(json_file, settings)
+        return
+
+    exporter = create_metrics_exporter(settings, args)
+    if args.jobs:
+        settings['file_jobs'] = args.jobs
+    if args.priority:
+        settings['quota_strategy'] = 'priority'
+        settings['priority'] = args.priority
+
+    # 2. 查找文件 (先做增量检查：全部最新时无需初始化翻译后端、查询配额与加载缓存)
+    watch_paths = args.paths or [Path.cwd()]
+    srt_files: List[Path] = []
+    build_state = None
+    if args.serve is None:
+        srt_files = find_srt_files(watch_paths, args.recursive, args.include, args.exclude, settings['target_lang'])
+        if not srt_files and not args.watch:
+            print(f"\n⚠️ 未找到待翻译的 SRT 文件 (*.srt，跳过 *.zh.srt 与 *{output_suffix(settings['target_lang'])})。")
+            print("请将 SRT 文件放入程序所在目录，或通过命令行参数指定文件/目录后重试。")
+            if exporter is not None:
+                exporter.close()
+            return
+
+        build_state = BuildState(fingerprint=config_fingerprint(settings), target_lang=settings['target_lang'])
+        if not args.force:
+            stale_files = [f for f in srt_files if not build_state.is_up_to_date(f)]
+            skipped = len(srt_files) - len(stale_files)
+            if skipped:
+                print(f"⏭️ 跳过 {skipped} 个输出已是最新的文件 (使用 --force 强制重新处理)。")
+            build_state.save()
+            srt_files = stale_files
+            if not srt_files and not args.watch:
+                print("\n🎉 所有文件均已是最新，无需处理。")
+                if exporter is not None:
+                    exporter.close()
+                return
+
+    # 3. 加载缓存；翻译后端 (及配额检查) 延迟到确有待翻译文本时才创建，任务接口启动时立即创建
+    if args.serve is not None:
+        api = create_checked_translator(settings)
+    else:
+        api = DeferredTranslator(lambda: create_checked_translator(settings))
+    try:
+        cache = TranslationCache(create_cache_backend(settings))
+    except (EnvironmentError, sqlite3.Error) as e:
+        print(f"🔴 缓存初始化失败: {e}")
+        sys.exit(1)
+    file_store = None
+    if settings['file_store']:
+        file_store = FileTranslationStore(max_bytes=int(settings['file_store_max_mb'] * 1024 * 1024),
+                                          fingerprint=config_fingerprint(settings))
+
+    if args.serve is not None:
+        try:
+            TranslationJobServer(api, cache, settings, file_store).serve_forever(
+                settings['serve_host'], args.serve or settings['serve_port'])
+        except OSError as e:
+            print(f"🔴 任务接口启动失败: {e}")
+            sys.exit(1)
+        finally:
+            cache.close()
+            api.close()
+            if exporter is not None:
+                exporter.close()
+        return
+
+    def run_files(files: List[Path]):
+        # 本次可用的字符预算：配额阈值以内的剩余字符 (监视模式下按已计费字符逐轮扣减)；
+        # 延迟到确有待翻译文本时才求值
+        def char_budget() -> int | None:
+            return remaining_char_budget(api, settings['quota_threshold'])
+        if args.use_async and not args.dry_run:
+            asyncio.run(process_srt_files_async(files, api, cache, settings, build_state, file_store,
+                                                char_budget=char_budget))
+        else:
+            process_srt_files(files, api, cache, settings, build_state, file_store,
+                              char_budget=char_budget, dry_run=args.dry_run)
+
+    try:
+        if args.watch:
+            watcher = FileWatcher(watch_paths, build_state, args.recursive, args.include, args.exclude,
+                                  poll_interval=settings['watch_interval'], debounce=settings['watch_debounce'])
+            watch_srt_files(watcher, run_files, srt_files)
+        else:
+            print(f"找到 {len(srt_files)} 个 SRT 文件，开始翻译...")
+            run_files(srt_files)
+    except QuotaExceededError as e:
+        print(f"\n🔴 DeepL API 配额已用尽: {e}")
+        print("已完成的翻译已保存到缓存，配额恢复后重新运行即可继续。")
+        sys.exit(1)
+    except AuthError:
+        # 详细原因已由 DeepLAPI 打印
+        print("已完成的翻译已保存到缓存，修正 API Key 后重新运行即可继续。")
+        sys.exit(1)
+    finally:
+        cache.close()
+        api.close()
+        if exporter is not None:
+            exporter.close()
+        if args.profile or args.profile_json:
+            PROFILER.print_report()
+            if args.profile_json:
+                PROFILER.write_json(args.profile_json)
+                print(f"\n📄 性能统计已写入 {args.profile_json}")
 
-    print("\n🎉 所有文件处理完毕。")
+    if not args.dry_run and not args.watch:
+        print("\n🎉 所有文件处理完毕。")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+"""本地 DeepL API 模拟服务器 (用于离线基准测试与调试)
+
+实现 /v2/translate 与 /v2/usage 两个端点：
+- 每段 text 返回 "<目标语言>:原文" 作为译文，按原文字符数计费；
+- 可配置固定延迟、随机 5xx 错误率、周期性 429 突发、字符配额 (超出返回 456)
+  以及最先若干个被拒绝 (403) 的翻译请求；
+- 字符配额按 auth_key 分别计算，便于测试多 Key 负载均衡与故障切换。
+
+用法:
+    python3 mock_deepl.py --port 8765 --latency 0.2 --error-rate 0.05
+然后在 config.ini 中将 translate_url / usage_url 指向 http://127.0.0.1:8765/v2/...
+"""
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockDeepLState:
+    """模拟服务器的配置与计数 (线程安全)"""
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, burst_every: int = 0,
+                 burst_length: int = 1, retry_after: float = 0.1, character_limit: int = 500000,
+                 seed: int = 0, forbidden_requests: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.character_limit = character_limit
+        self.forbidden_requests = forbidden_requests
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.character_count = 0
+        self.key_usage = {}
+        self.requests = 0
+        self.usage_requests = 0
+        self.statuses = {}
+
+    def next_status(self, chars: int, key: str = "") -> int:
+        """决定本次翻译请求的响应状态，成功时计入该 Key 的字符用量"""
+        with self.lock:
+            self.requests += 1
+            if self.requests <= self.forbidden_requests:
+                status = 403
+            elif self.burst_every and (self.requests - 1) % self.burst_every < self.burst_length:
+                status = 429
+            elif self.rng.random() < self.error_rate:
+                status = 503
+            elif self.key_usage.get(key, 0) + chars > self.character_limit:
+                status = 456
+            else:
+                status = 200
+                self.character_count += chars
+                self.key_usage[key] = self.key_usage.get(key, 0) + chars
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            return status
+
+    def usage(self, key: str = "") -> int:
+        """/v2/usage 查询：返回该 Key 已用的字符数"""
+        with self.lock:
+            self.usage_requests += 1
+            return self.key_usage.get(key, 0)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "usage_requests": self.usage_requests,
+                "character_count": self.character_count,
+                "key_usage": dict(self.key_usage),
+                "statuses": dict(self.statuses),
+            }
+
+class MockDeepLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self) -> MockDeepLState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_form(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return parse_qs(body.decode("utf-8"), keep_blank_values=True)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/v2/usage":
+            self._send_json(404, {"message": "Not found"})
+            return
+        key = parse_qs(url.query).get("auth_key", [""])[0]
+        self._send_json(200, {
+            "character_count": self.state.usage(key),
+            "character_limit": self.state.character_limit,
+        })
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/v2/translate":
+            self._send_json(404, {"message": "Not found"})
+            return
+        form = self._read_form()
+        texts = form.get("text", [])
+        target_lang = form.get("target_lang", ["ZH"])[0]
+        key = form.get("auth_key", [""])[0]
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        status = self.state.next_status(sum(len(text) for text in texts), key)
+        if status == 429:
+            self._send_json(429, {"message": "Too many requests"},
+                            {"Retry-After": str(self.state.retry_after)})
+        elif status == 503:
+            self._send_json(503, {"message": "Service unavailable"})
+        elif status == 456:
+            self._send_json(456, {"message": "Quota exceeded"})
+        elif status == 403:
+            self._send_json(403, {"message": "Wrong endpoint or authorization key"})
+        else:
+            self._send_json(200, {"translations": [
+                {"detected_source_language": "EN", "text": f"{target_lang}:{text}"} for text in texts
+            ]})
+
+def start_mock_server(state: MockDeepLState, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """在后台线程中启动模拟服务器，port 为 0 时自动分配端口"""
+    server = ThreadingHTTPServer((host, port), MockDeepLHandler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 DeepL API 模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个翻译请求的固定延迟 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 503 的概率")
+    parser.add_argument("--burst-every", type=int, default=0, help="每 N 个请求出现一次 429 突发 (0 为关闭)")
+    parser.add_argument("--burst-length", type=int, default=1, help="每次 429 突发连续的请求数")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="429 响应的 Retry-After (秒)")
+    parser.add_argument("--character-limit", type=int, default=500000, help="每个 Key 的字符配额，超出后返回 456")
+    parser.add_argument("--forbidden-requests", type=int, default=0, help="最先 N 个翻译请求返回 403")
+    args = parser.parse_args()
+
+    state = MockDeepLState(args.latency, args.error_rate, args.burst_every, args.burst_length,
+                           args.retry_after, args.character_limit, forbidden_requests=args.forbidden_requests)
+    server = start_mock_server(state, args.host, args.port)
+    print(f"🧪 模拟 DeepL API 已启动: http://{args.host}:{server.server_address[1]}/v2/translate")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n📊 {state.summary()}")
+
+if __name__ == "__main__":
+    main()
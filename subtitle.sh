@@ -17,5 +17,5 @@ fi
 source "$VENV_PATH/bin/activate"
 
 # Run the project
-python3 ./main.py
+python3 -m main
 